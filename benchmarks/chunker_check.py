@@ -0,0 +1,55 @@
+import os
+import sys
+
+# Import the pipeline modules from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source_chunker import chunk_source, statement_boundaries, split_at
+
+# Source files with the statements the chunker must keep whole and the header it must share with every chunk
+cases = [
+    {
+        'name': 'destructured_require',
+        'code': "const { a, b } = require('./x');\nconst path = require('path');\n\nfunction f() {\n    return a(b);\n}\n",
+        'statements': ["const { a, b } = require('./x');", "const path = require('path');", 'function f() {\n    return a(b);\n}'],
+        'header': "const { a, b } = require('./x');\nconst path = require('path');"
+    },
+    {
+        'name': 'destructured_require_without_semicolon',
+        'code': "const { a } = require('./x')\n\nfunction f() {\n    return a()\n}\n",
+        'statements': ["const { a } = require('./x')", 'function f() {\n    return a()\n}'],
+        'header': "const { a } = require('./x')"
+    },
+    {
+        'name': 'object_destructuring_assignment',
+        'code': 'let { x, y } = point;\nconst add = ({ a }) => {\n    return a;\n};\n',
+        'statements': ['let { x, y } = point;', 'const add = ({ a }) => {\n    return a;\n};'],
+        'header': ''
+    },
+    {
+        'name': 'java_imports_and_class',
+        'code': 'package demo;\n\nimport java.util.List;\n\npublic class A {\n    void f() {}\n}\n',
+        'statements': ['package demo;', 'import java.util.List;', 'public class A {\n    void f() {}\n}'],
+        'header': 'package demo;\n\nimport java.util.List;'
+    },
+]
+
+# Function to check each case, returning the names of the failing ones
+def run_checks():
+    failures = []
+    for case in cases:
+        statements = [segment.strip() for segment in split_at(case['code'], statement_boundaries(case['code']))]
+        header, _ = chunk_source(case['code'], 40)
+        if statements != case['statements'] or header != case['header']:
+            failures.append(case['name'])
+    return failures
+
+def main():
+    failures = run_checks()
+    print(f'{len(cases) - len(failures)}/{len(cases)} chunker cases correct')
+    for failure in failures:
+        print(f'  incorrect: {failure}')
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
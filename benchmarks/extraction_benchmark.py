@@ -0,0 +1,74 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+# Import the pipeline modules from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import code_migration_request
+
+corpus_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'extraction_corpus.json')
+
+# Previous regex-based extraction, kept to compare correctness and cost against the single-pass parser
+def legacy_extract_code_combined(response_json, target_language):
+    migrated_code = response_json.get('migrated_code', '')
+    if not target_language:
+        code_block_match = re.search(r'```([\s\S]*?)```', migrated_code, re.IGNORECASE)
+    else:
+        code_block_match = re.search(rf'```{target_language}\n([\s\S]*?)```', migrated_code, re.IGNORECASE)
+        if not code_block_match:
+            code_block_match = re.search(rf'```{target_language}\n([\s\S]*?)\n```', migrated_code, re.IGNORECASE)
+    return code_block_match.group(1).strip() if code_block_match else migrated_code
+
+# Function to run one extraction function over the corpus, returning the failures and the mean time per response
+def run_benchmark(cases, extract, iterations):
+    failures = []
+    for case in cases:
+        code_migration_request.target_language = case['target_language']
+        extracted = extract({'migrated_code': case['response']}, case['target_language'])
+        if extracted != case['expected']:
+            failures.append(case['name'])
+
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        for case in cases:
+            code_migration_request.target_language = case['target_language']
+            extract({'migrated_code': case['response']}, case['target_language'])
+    mean_seconds = (time.perf_counter() - start_time) / (iterations * len(cases))
+
+    return failures, mean_seconds
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure correctness and cost of code block extraction over the golden corpus.')
+    parser.add_argument('--iterations', type=int, default=2000, help='number of passes over the corpus when timing')
+    args = parser.parse_args()
+
+    with open(corpus_path, 'r', encoding='utf-8') as corpus_file:
+        cases = json.load(corpus_file)
+
+    extractors = {
+        'legacy': legacy_extract_code_combined,
+        'single-pass': lambda response_json, _: code_migration_request.extract_code_combined(response_json),
+    }
+
+    # Check the configured extraction function of every model is covered by the corpus
+    missing_models = set(code_migration_request.extraction_functions) - {case['model'] for case in cases}
+    if missing_models:
+        print(f'No corpus responses for: {", ".join(sorted(missing_models))}')
+
+    results = {}
+    for name, extract in extractors.items():
+        failures, mean_seconds = run_benchmark(cases, extract, args.iterations)
+        results[name] = failures
+        print(f'{name}: {len(cases) - len(failures)}/{len(cases)} correct, {mean_seconds * 1e6:.1f} µs per response')
+        for failure in failures:
+            print(f'  incorrect: {failure}')
+
+    # Fail when the extraction used by the pipeline no longer matches the golden corpus
+    return 1 if results['single-pass'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,228 @@
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from werkzeug.serving import make_server
+
+# Import the pipeline modules from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The benchmark serves the API without a response cache, so keep the import from creating output/cache
+os.environ['CACHE_DISK_ENABLED'] = 'false'
+
+import code_migration_api
+import code_migration_request
+
+stub_model_name = 'Stub - Local'
+
+# Local fake model with configurable latency, token rate and failure rate, so no network is needed
+class StubLLM(LLM):
+    latency_seconds: float = 0.05
+    tokens_per_second: float = 0.0
+    failure_rate: float = 0.0
+    target_language: str = 'kotlin'
+
+    @property
+    def _llm_type(self):
+        return 'stub'
+
+    def response_text(self, prompt):
+        if random.random() < self.failure_rate:
+            raise RuntimeError('Stub model failure')
+
+        code = prompt.split('Answer: ', 1)[-1]
+        return f'Here is the migrated code:\n\n```{self.target_language}\n{code}\n```\n\nThe code keeps the same behaviour.'
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        text = self.response_text(prompt)
+        time.sleep(self.latency_seconds)
+
+        # Approximate four characters per token when simulating generation speed
+        if self.tokens_per_second:
+            time.sleep(len(text) / 4 / self.tokens_per_second)
+        return text
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        text = self.response_text(prompt)
+        time.sleep(self.latency_seconds)
+
+        for token_start in range(0, len(text), 4):
+            if self.tokens_per_second:
+                time.sleep(1 / self.tokens_per_second)
+            yield GenerationChunk(text=text[token_start:token_start + 4])
+
+# Function to write a synthetic Java or JavaScript corpus spread over several directories
+def generate_corpus(directory, file_count, source_language, methods_per_file):
+    for file_number in range(file_count):
+        package_directory = os.path.join(directory, f'package{file_number % 5}')
+        os.makedirs(package_directory, exist_ok=True)
+
+        # Vary the file sizes so the corpus has a mix of small and large files
+        method_count = max(1, int(methods_per_file * random.uniform(0.2, 2.0)))
+        if source_language == 'java':
+            methods = ''.join(
+                f'    public int method{i}(int value) {{\n        return value * {i};\n    }}\n\n' for i in range(method_count)
+            )
+            code = f'import java.util.List;\n\npublic class Sample{file_number} {{\n{methods}}}\n'
+            file_name = f'Sample{file_number}.java'
+        else:
+            methods = ''.join(
+                f'function method{i}(value) {{\n    return value * {i};\n}}\n\n' for i in range(method_count)
+            )
+            code = f"const path = require('path');\n\n{methods}module.exports = {{ method0 }};\n"
+            file_name = f'sample{file_number}.js'
+
+        with open(os.path.join(package_directory, file_name), 'w', encoding='utf-8') as file:
+            file.write(code)
+
+# Function to return the value at the given percentile of a sorted list
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# Function to reset the request script state between benchmark runs
+def reset_driver(mode, workers, limit):
+    code_migration_request.total_requests = 0
+    code_migration_request.cache_hits = 0
+    code_migration_request.model_times = {}
+    code_migration_request.manifest = None
+    code_migration_request.model_semaphores.clear()
+    code_migration_request.provider_semaphores.clear()
+    code_migration_request.max_workers = workers
+    code_migration_request.default_concurrency_limit = limit
+    code_migration_request.concurrent_mode = mode != 'sequential'
+    code_migration_request.batch_mode = mode == 'batch'
+    code_migration_request.stream_mode = mode == 'stream'
+
+    # Without client retries every failed model call fails its file, so the error rate counts each failure
+    code_migration_request.max_retries = 0
+    code_migration_request.http_session = code_migration_request.create_http_session()
+
+# Function to run one driver mode over the corpus and return the per-file latencies and the throughput
+def run_workload(mode, corpus_directory, log_file):
+    latencies = []
+    latencies_lock = threading.Lock()
+    file_count = sum(1 for _ in code_migration_request.find_source_files(corpus_directory))
+
+    # Time every file (or batch of files) through the driver's own functions
+    original_migrate_file = code_migration_request.migrate_file
+    original_migrate_batch = code_migration_request.migrate_batch
+
+    def timed_migrate_file(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return original_migrate_file(*args, **kwargs)
+        finally:
+            with latencies_lock:
+                latencies.append(time.perf_counter() - start_time)
+
+    def timed_migrate_batch(file_paths, *args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return original_migrate_batch(file_paths, *args, **kwargs)
+        finally:
+            with latencies_lock:
+                latencies.extend([time.perf_counter() - start_time] * len(file_paths))
+
+    code_migration_request.migrate_file = timed_migrate_file
+    code_migration_request.migrate_batch = timed_migrate_batch
+    start_time = time.perf_counter()
+    try:
+        models = [stub_model_name]
+        extraction_functions = code_migration_request.extraction_functions
+        if mode == 'batch':
+            code_migration_request.migrate_files_in_batches([corpus_directory], models, extraction_functions, log_file)
+        elif mode == 'sequential':
+            code_migration_request.migrate_files_from_directory(corpus_directory, stub_model_name, extraction_functions, log_file)
+        else:
+            code_migration_request.migrate_files_concurrently([corpus_directory], models, extraction_functions, log_file)
+    finally:
+        elapsed = time.perf_counter() - start_time
+        code_migration_request.migrate_file = original_migrate_file
+        code_migration_request.migrate_batch = original_migrate_batch
+
+    return {
+        'files': file_count,
+        'files_per_second': file_count / elapsed if elapsed else 0.0,
+        'latencies': sorted(latencies),
+        'error_rate': 1 - code_migration_request.total_requests / file_count if file_count else 0.0
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test of the migration pipeline against a local stub model.')
+    parser.add_argument('--modes', nargs='+', default=['sequential', 'concurrent', 'batch', 'stream'],
+                        choices=['sequential', 'concurrent', 'batch', 'stream'])
+    parser.add_argument('--files', type=int, default=40, help='number of files in the synthetic corpus')
+    parser.add_argument('--methods-per-file', type=int, default=10, help='average number of methods per synthetic file')
+    parser.add_argument('--language', choices=['java', 'javascript'], default='java')
+    parser.add_argument('--latency', type=float, nargs='+', default=[0.05], help='stub model latency in seconds')
+    parser.add_argument('--tokens-per-second', type=float, nargs='+', default=[0.0], help='stub generation speed (0 for instant)')
+    parser.add_argument('--failure-rate', type=float, nargs='+', default=[0.0], help='fraction of stub calls that fail')
+    parser.add_argument('--workers', type=int, default=8, help='client thread pool size')
+    parser.add_argument('--limit', type=int, default=8, help='in-flight limit per model and provider')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    target_language = 'kotlin' if args.language == 'java' else 'typescript'
+
+    # Serve the real Flask app on a free local port, without the response cache so every request reaches the model
+    code_migration_api.CACHE_ENABLED = False
+    code_migration_api.app.logger.disabled = True
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, code_migration_api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_endpoint = f'http://127.0.0.1:{server.server_port}/code-migration'
+
+    code_migration_request.api_endpoint = api_endpoint
+    code_migration_request.batch_api_endpoint = f'{api_endpoint}/batch'
+    code_migration_request.stream_api_endpoint = f'{api_endpoint}/stream'
+    code_migration_request.source_language = args.language
+    code_migration_request.target_language = target_language
+    code_migration_request.extraction_functions[stub_model_name] = code_migration_request.extract_code_combined
+
+    print(f'{"mode":<11} {"latency":>8} {"tok/s":>7} {"fail":>5} {"files":>6} {"files/s":>8} '
+          f'{"p50 s":>7} {"p95 s":>7} {"p99 s":>7} {"errors":>7}')
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        corpus_directory = os.path.join(work_directory, 'corpus')
+        generate_corpus(corpus_directory, args.files, args.language, args.methods_per_file)
+
+        # Output files are written relative to the working directory
+        original_directory = os.getcwd()
+        os.chdir(work_directory)
+        try:
+            with open(os.devnull, 'w', encoding='utf-8') as log_file:
+                for latency in args.latency:
+                    for tokens_per_second in args.tokens_per_second:
+                        for failure_rate in args.failure_rate:
+                            code_migration_api.MODELS.register(stub_model_name, lambda: StubLLM(
+                                latency_seconds=latency,
+                                tokens_per_second=tokens_per_second,
+                                failure_rate=failure_rate,
+                                target_language=target_language
+                            ))
+
+                            for mode in args.modes:
+                                reset_driver(mode, args.workers, args.limit)
+                                result = run_workload(mode, corpus_directory, log_file)
+                                latencies = result['latencies']
+                                print(f'{mode:<11} {latency:>8.3f} {tokens_per_second:>7.0f} {failure_rate:>5.2f} '
+                                      f'{result["files"]:>6} {result["files_per_second"]:>8.2f} '
+                                      f'{percentile(latencies, 0.50):>7.3f} {percentile(latencies, 0.95):>7.3f} '
+                                      f'{percentile(latencies, 0.99):>7.3f} {result["error_rate"]:>7.1%}')
+        finally:
+            os.chdir(original_directory)
+            server.shutdown()
+
+if __name__ == "__main__":
+    main()
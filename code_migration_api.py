@@ -1,65 +1,496 @@
-from flask import Flask, request, jsonify
+import time
+
+# Start time used to measure how long the server takes to start
+startup_start_time = time.perf_counter()
+
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, request, jsonify, stream_with_context, g
 from langchain_core.prompts import PromptTemplate
-from langchain_openai.chat_models import ChatOpenAI
-from langchain_google_vertexai import VertexAI
-from langchain_community.llms import Ollama
+from langchain_core.runnables import RunnableLambda
+from migration_cache import MigrationCache, MemoryCache, DiskCache, cache_key
+from rate_limiter import RateLimiter, RateLimitExceeded, estimate_tokens
+from pipeline_tracing import Tracer
+from pipeline_metrics import MetricsRegistry, Counter, Gauge, Histogram, CallbackMetric
 
 app = Flask(__name__)
 
+# Registry that builds each model client the first time its name is requested
+class ModelRegistry:
+    def __init__(self, factories):
+        self.factories = dict(factories)
+        self.models = {}
+        self.lock = threading.Lock()
+
+    def register(self, name, factory):
+        with self.lock:
+            self.factories[name] = factory
+            self.models.pop(name, None)
+
+    def names(self):
+        return list(self.factories)
+
+    def loaded_names(self):
+        return list(self.models)
+
+    def __contains__(self, name):
+        return name in self.factories
+
+    def get(self, name, default=None):
+        if name not in self.factories:
+            return default
+
+        model = self.models.get(name)
+        if model is None:
+            with self.lock:
+                model = self.models.get(name)
+                if model is None:
+                    model = self.factories[name]()
+                    self.models[name] = model
+
+        return model
+
+    # Build the listed clients up front, logging (rather than failing on) unavailable providers
+    def warm_up(self, names):
+        for name in names:
+            try:
+                self.get(name)
+            except Exception as e:
+                app.logger.warning(f'Unable to warm up model {name}: {e}')
+
+# Factory functions importing each provider only when one of its models is first used
+def openai_model(**model_args):
+    def factory():
+        from langchain_openai.chat_models import ChatOpenAI
+        return ChatOpenAI(**model_args)
+    return factory
+
+def ollama_model(**model_args):
+    def factory():
+        from langchain_community.llms import Ollama
+        return Ollama(**model_args)
+    return factory
+
+def vertexai_model(**model_args):
+    def factory():
+        from langchain_google_vertexai import VertexAI
+        return VertexAI(**model_args)
+    return factory
+
 # AI Models
-MODELS = {
-    'OpenAI - GPT-3.5 Turbo': ChatOpenAI(model_name='gpt-3.5-turbo-0125'),
-    'OpenAI - GPT-4o': ChatOpenAI(model_name='gpt-4o'),
-    'OpenAI - GPT-4 Turbo': ChatOpenAI(model_name='gpt-4-turbo'),
-    'Ollama - Llama 3': Ollama(model='llama3'),
-    'Ollama - Llama 2': Ollama(model='llama2'),
-    'Ollama - CodeLlama': Ollama(model='codellama'),
-    'Ollama - CodeGemma': Ollama(model='codegemma'),
-    'VertexAI - Gemini Pro': VertexAI(model_name='gemini-pro'),
+MODELS = ModelRegistry({
+    'OpenAI - GPT-3.5 Turbo': openai_model(model_name='gpt-3.5-turbo-0125'),
+    'OpenAI - GPT-4o': openai_model(model_name='gpt-4o'),
+    'OpenAI - GPT-4 Turbo': openai_model(model_name='gpt-4-turbo'),
+    'Ollama - Llama 3': ollama_model(model='llama3'),
+    'Ollama - Llama 2': ollama_model(model='llama2'),
+    'Ollama - CodeLlama': ollama_model(model='codellama'),
+    'Ollama - CodeGemma': ollama_model(model='codegemma'),
+    'VertexAI - Gemini Pro': vertexai_model(model_name='gemini-pro'),
     # Max Token specification added, as the responses are cut short without it for the PaLM 2 and Codey models only
-    'VertexAI - PaLM 2': VertexAI(model_name='text-bison', max_output_tokens=2048),
-    'VertexAI - Codey': VertexAI(model_name='code-bison', max_output_tokens=2048)
+    'VertexAI - PaLM 2': vertexai_model(model_name='text-bison', max_output_tokens=2048),
+    'VertexAI - Codey': vertexai_model(model_name='code-bison', max_output_tokens=2048)
+})
+
+# Comma-separated list of models to build at startup instead of on first use
+WARM_UP_MODELS = [name.strip() for name in os.getenv('WARM_UP_MODELS', '').split(',') if name.strip()]
+
+# Response cache keyed on a hash of the model name, prompt and code
+CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() == 'true'
+CACHE = MigrationCache(
+    MemoryCache(
+        max_entries=int(os.getenv('CACHE_MAX_ENTRIES', '256')),
+        ttl_seconds=int(os.getenv('CACHE_TTL_SECONDS', '3600'))
+    ),
+    DiskCache(
+        os.getenv('CACHE_DIRECTORY', 'output/cache'),
+        max_bytes=int(os.getenv('CACHE_DISK_MAX_BYTES', str(512 * 1024 * 1024))),
+        ttl_seconds=int(os.getenv('CACHE_DISK_TTL_SECONDS', str(7 * 24 * 3600)))
+    ) if os.getenv('CACHE_DISK_ENABLED', 'true').lower() == 'true' else None
+)
+
+# Requests-per-minute and tokens-per-minute budgets per provider (0 means no limit)
+PROVIDER_RATE_LIMITS = {
+    'OpenAI': RateLimiter(
+        'OpenAI',
+        requests_per_minute=int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', '500')),
+        tokens_per_minute=int(os.getenv('OPENAI_TOKENS_PER_MINUTE', '30000'))
+    ),
+    'VertexAI': RateLimiter(
+        'VertexAI',
+        requests_per_minute=int(os.getenv('VERTEXAI_REQUESTS_PER_MINUTE', '60')),
+        tokens_per_minute=int(os.getenv('VERTEXAI_TOKENS_PER_MINUTE', '0'))
+    ),
+    'Ollama': RateLimiter(
+        'Ollama',
+        requests_per_minute=int(os.getenv('OLLAMA_REQUESTS_PER_MINUTE', '0')),
+        tokens_per_minute=int(os.getenv('OLLAMA_TOKENS_PER_MINUTE', '0'))
+    )
 }
 
-@app.route('/code-migration', methods=['POST'])
-def code_migration():
-    # Parse request data
-    request_data = request.json
-    selected_model = request_data.get('model')
-    prompt_data = request_data.get('prompt')
-    code_to_migrate = request_data.get('code')
+# Longest time a request waits for rate limit budget before the API returns 429
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv('RATE_LIMIT_MAX_WAIT_SECONDS', '30'))
 
-    # Initialise the model based on the selected model name above
-    model = MODELS.get(selected_model)
-    if model is None:
-        return jsonify({'error': 'Invalid model name'}), 400
+# Maximum number of concurrent model calls within each model group of a batch request
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', '4'))
 
+# Timing spans for each server stage, one JSON object per line (an empty API_TRACE_PATH disables the file)
+TRACER = Tracer(os.getenv('API_TRACE_PATH', 'output/traces/api_traces.jsonl'), 'api')
+
+# Prometheus metrics served at /metrics
+METRICS = MetricsRegistry()
+HTTP_REQUESTS = METRICS.register(Counter(
+    'migration_http_requests_total', 'Requests answered, by endpoint, model and status code', ['endpoint', 'model', 'status']
+))
+HTTP_REQUEST_SECONDS = METRICS.register(Histogram(
+    'migration_http_request_seconds', 'Time to answer a request, including streamed bodies', ['endpoint', 'model']
+))
+HTTP_IN_FLIGHT = METRICS.register(Gauge(
+    'migration_http_requests_in_flight', 'Requests currently being answered', ['endpoint']
+))
+STAGE_SECONDS = METRICS.register(Histogram(
+    'migration_stage_seconds', 'Time spent in each server stage (model_load, cache, rate_limit_wait, llm, normalise)', ['stage', 'model']
+))
+STAGE_ERRORS = METRICS.register(Counter(
+    'migration_stage_errors_total', 'Server stages that raised an error, including rate limit timeouts', ['stage', 'model']
+))
+METRICS.register(CallbackMetric(
+    'migration_cache_events_total', 'Response cache lookups by outcome', 'counter', ['outcome'],
+    lambda: {(outcome,): count for outcome, count in CACHE.get_stats().items()}
+))
+
+# Function to update the stage metrics from each finished span
+def record_stage_metrics(span):
+    model = span['attributes'].get('model', '')
+    STAGE_SECONDS.observe(span['duration'], stage=span['name'], model=model)
+    if span['status'] == 'error':
+        STAGE_ERRORS.inc(stage=span['name'], model=model)
+
+TRACER.add_listener(record_stage_metrics)
+
+# Raised when the model output cannot be turned into text
+class MigrationError(Exception):
+    pass
+
+# Function to build the prompt and model chain
+def build_chain(model):
     # Template for the prompt
     template = '''Question: {question}\n\nAnswer: {answer}'''
     prompt = PromptTemplate.from_template(template)
 
     # Create a chain with the prompt and model
-    chain = prompt | model
-
-    # Invoke the chain to migrate the code 
-    migrated_code = chain.invoke({'question': prompt_data, 'answer': code_to_migrate})
+    return prompt | model
 
+# Function to extract the text from the chain output
+def normalise_output(migrated_code):
     # Extracting content based on the type of the migrated_code object
     if isinstance(migrated_code, str):  # If migrated_code is a string
-        migrated_content = migrated_code.strip()
+        return migrated_code.strip()
     elif hasattr(migrated_code, 'content'):  # If migrated_code has 'content' attribute
-        migrated_content = migrated_code.content.strip()
-    else:
-        return jsonify({'error': 'Unable to extract migrated code'}), 500
+        return migrated_code.content.strip()
+    raise MigrationError('Unable to extract migrated code')
 
-    # Construct response
-    response = {
+# Function to extract the text from a streamed chunk
+def chunk_text(chunk):
+    if isinstance(chunk, str):
+        return chunk
+    elif hasattr(chunk, 'content') and isinstance(chunk.content, str):
+        return chunk.content
+    return ''
+
+# Function to wait for the provider's rate limit budget, counting the output as roughly the size of the input
+def acquire_rate_limit(selected_model, tokens, requests=1):
+    rate_limiter = PROVIDER_RATE_LIMITS.get(selected_model.split(' - ')[0])
+    if rate_limiter is not None:
+        with TRACER.span('rate_limit_wait', model=selected_model, tokens=tokens * 2, requests=requests):
+            rate_limiter.acquire(tokens * 2, requests=requests, max_wait=RATE_LIMIT_MAX_WAIT_SECONDS)
+
+# Function to build the response returned when the rate limit budget runs out
+def rate_limit_response(e):
+    response = jsonify({'error': str(e)})
+    response.headers['Retry-After'] = str(max(1, int(e.retry_after + 0.5)))
+    return response, 429
+
+# Function to invoke the model and return the migrated content
+def run_migration(selected_model, model, prompt_data, code_to_migrate):
+    acquire_rate_limit(selected_model, estimate_tokens(prompt_data) + estimate_tokens(code_to_migrate))
+    chain = build_chain(model)
+
+    # Invoke the chain to migrate the code 
+    with TRACER.span('llm', model=selected_model):
+        migrated_code = chain.invoke({'question': prompt_data, 'answer': code_to_migrate})
+    with TRACER.span('normalise', model=selected_model):
+        return normalise_output(migrated_code)
+
+# Function to migrate several inputs for one model, up to BATCH_MAX_CONCURRENCY at a time
+def run_batch_migration(selected_model, items):
+    chain = build_chain(MODELS.get(selected_model))
+    inputs = [{'question': item.get('prompt'), 'answer': item.get('code')} for item in items]
+
+    acquire_rate_limit(
+        selected_model,
+        sum(estimate_tokens(item.get('prompt')) + estimate_tokens(item.get('code')) for item in items),
+        requests=len(items)
+    )
+
+    # The chain's own batch runs the prompts of completion models (Ollama, VertexAI) one after another and fails
+    # them together, so invoke each item on the runnable thread pool instead. Failed items are returned as
+    # exceptions so they do not fail the rest of the batch.
+    with TRACER.span('llm_batch', model=selected_model, items=len(items)):
+        outputs = RunnableLambda(chain.invoke).batch(inputs, config={'max_concurrency': BATCH_MAX_CONCURRENCY}, return_exceptions=True)
+
+    results = []
+    for output in outputs:
+        if isinstance(output, Exception):
+            results.append(output)
+            continue
+        try:
+            results.append(normalise_output(output))
+        except MigrationError as e:
+            results.append(e)
+
+    return results
+
+# Function to build the response returned for one migrated input
+def build_response(selected_model, code_to_migrate, migrated_content, cache_hit):
+    return {
         'original_code': code_to_migrate.strip(),
         'migrated_code': migrated_content,
-        'model_used': selected_model  
+        'model_used': selected_model,
+        'cache_hit': cache_hit
     }
 
+# Function to get the model label for the request metrics, without letting unknown names add labels
+def request_model_label():
+    request_data = request.get_json(silent=True)
+    selected_model = request_data.get('model') if isinstance(request_data, dict) else None
+    if selected_model is None:
+        return ''
+    return selected_model if selected_model in MODELS else 'unknown'
+
+# Function to build the model client, timing it as its own stage
+def load_model(selected_model):
+    with TRACER.span('model_load', trace_id=request.headers.get('X-Trace-Id'), model=selected_model):
+        return MODELS.get(selected_model)
+
+@app.before_request
+def start_request_metrics():
+    g.request_start_time = time.perf_counter()
+    HTTP_IN_FLIGHT.inc(endpoint=request.endpoint or 'unknown')
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    model = request_model_label()
+    start_time = g.request_start_time
+
+    # Record the request once the body has been sent, so streamed responses are timed to their last frame
+    def finish():
+        HTTP_IN_FLIGHT.dec(endpoint=endpoint)
+        HTTP_REQUESTS.inc(endpoint=endpoint, model=model, status=str(response.status_code))
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start_time, endpoint=endpoint, model=model)
+
+    response.call_on_close(finish)
+    return response
+
+@app.route('/code-migration', methods=['POST'])
+def code_migration():
+    # Parse request data
+    request_data = request.json
+    selected_model = request_data.get('model')
+    prompt_data = request_data.get('prompt')
+    code_to_migrate = request_data.get('code')
+
+    # Initialise the model based on the selected model name above
+    if selected_model not in MODELS:
+        return jsonify({'error': 'Invalid model name'}), 400
+    try:
+        model = load_model(selected_model)
+    except Exception as e:
+        return jsonify({'error': f'Model unavailable: {e}'}), 503
+
+    try:
+        # Root span of the request on the API, covering the cache lookup and any model call
+        with TRACER.span('migration_request', trace_id=request.headers.get('X-Trace-Id'), model=selected_model) as attributes:
+            migrated_content, cache_hit = None, False
+            if CACHE_ENABLED:
+                key = cache_key(selected_model, prompt_data, code_to_migrate)
+
+                # Time only the lookup, the model call on a miss has its own llm span
+                with TRACER.span('cache_lookup', model=selected_model) as lookup_attributes:
+                    migrated_content = CACHE.lookup(key)
+                    lookup_attributes['cache_hit'] = migrated_content is not None
+
+                if migrated_content is not None:
+                    cache_hit = True
+                else:
+                    # Looks up again while joining any identical request in flight, so only one of them calls the model
+                    migrated_content, cache_hit = CACHE.get_or_compute(
+                        key, lambda: run_migration(selected_model, model, prompt_data, code_to_migrate)
+                    )
+            else:
+                migrated_content = run_migration(selected_model, model, prompt_data, code_to_migrate)
+            attributes['cache_hit'] = cache_hit
+    except RateLimitExceeded as e:
+        return rate_limit_response(e)
+    except MigrationError as e:
+        return jsonify({'error': str(e)}), 500
+
+    # Construct response
+    response = build_response(selected_model, code_to_migrate, migrated_content, cache_hit)
+
     return jsonify(response)
 
+@app.route('/code-migration/batch', methods=['POST'])
+def code_migration_batch():
+    # Parse request data, accepting either {'items': [...]} or a bare list
+    request_data = request.json
+    items = request_data.get('items') if isinstance(request_data, dict) else request_data
+    if not isinstance(items, list):
+        return jsonify({'error': 'Expected a list of items'}), 400
+
+    results = [None] * len(items)
+
+    # Group the items by model, answering cached items straight away
+    groups = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not isinstance(item.get('code'), str):
+            results[index] = {'error': 'Invalid item'}
+            continue
+
+        selected_model = item.get('model')
+        if selected_model not in MODELS:
+            results[index] = {'error': 'Invalid model name', 'model_used': selected_model}
+            continue
+
+        if CACHE_ENABLED:
+            cached_content = CACHE.lookup(cache_key(selected_model, item.get('prompt'), item['code']))
+            if cached_content is not None:
+                results[index] = build_response(selected_model, item['code'], cached_content, True)
+                continue
+            CACHE.count('misses')
+
+        groups.setdefault(selected_model, []).append(index)
+
+    # Run each model group through the batch API, with the groups running side by side
+    rate_limit_errors = []
+    with ThreadPoolExecutor(max_workers=max(1, len(groups))) as executor:
+        futures = {
+            executor.submit(run_batch_migration, selected_model, [items[index] for index in indices]): (selected_model, indices)
+            for selected_model, indices in groups.items()
+        }
+
+        for future, (selected_model, indices) in futures.items():
+            try:
+                outcomes = future.result()
+            except RateLimitExceeded as e:
+                rate_limit_errors.append(e)
+                continue
+            except Exception as e:
+                outcomes = [e] * len(indices)
+
+            for index, outcome in zip(indices, outcomes):
+                item = items[index]
+                if isinstance(outcome, Exception):
+                    results[index] = {'error': str(outcome), 'model_used': selected_model}
+                    continue
+
+                if CACHE_ENABLED:
+                    CACHE.store(cache_key(selected_model, item.get('prompt'), item['code']), outcome)
+                results[index] = build_response(selected_model, item['code'], outcome, False)
+
+    # A throttled group had no items migrated, so ask the client to retry the batch once the budget returns.
+    # The other groups' results are cached above, so the retry does not migrate them again.
+    if rate_limit_errors:
+        return rate_limit_response(max(rate_limit_errors, key=lambda e: e.retry_after))
+
+    return jsonify({'results': results})
+
+@app.route('/code-migration/stream', methods=['POST'])
+def code_migration_stream():
+    # Parse request data
+    request_data = request.json
+    selected_model = request_data.get('model')
+    prompt_data = request_data.get('prompt')
+    code_to_migrate = request_data.get('code')
+
+    # Initialise the model based on the selected model name above
+    if selected_model not in MODELS:
+        return jsonify({'error': 'Invalid model name'}), 400
+    try:
+        model = load_model(selected_model)
+    except Exception as e:
+        return jsonify({'error': f'Model unavailable: {e}'}), 503
+
+    key = cache_key(selected_model, prompt_data, code_to_migrate)
+    cached_content = CACHE.lookup(key) if CACHE_ENABLED else None
+
+    if cached_content is None:
+        if CACHE_ENABLED:
+            CACHE.count('misses')
+
+        # Wait for rate limit budget before the stream starts, so a 429 can still be returned
+        try:
+            acquire_rate_limit(selected_model, estimate_tokens(prompt_data) + estimate_tokens(code_to_migrate))
+        except RateLimitExceeded as e:
+            return rate_limit_response(e)
+
+    trace_id = request.headers.get('X-Trace-Id')
+
+    # Each frame is one JSON object per line: 'token' frames, then a 'final' or 'error' frame
+    def generate():
+        if cached_content is not None:
+            final = build_response(selected_model, code_to_migrate, cached_content, True)
+            yield json.dumps({'type': 'final', **final}) + '\n'
+            return
+
+        chain = build_chain(model)
+        parts = []
+        try:
+            with TRACER.span('llm_stream', trace_id=trace_id, model=selected_model) as attributes:
+                stream_start_time = time.perf_counter()
+                for chunk in chain.stream({'question': prompt_data, 'answer': code_to_migrate}):
+                    text = chunk_text(chunk)
+                    if text:
+                        if not parts:
+                            attributes['first_token_seconds'] = time.perf_counter() - stream_start_time
+                        parts.append(text)
+                        yield json.dumps({'type': 'token', 'content': text}) + '\n'
+
+            migrated_content = normalise_output(''.join(parts))
+        except Exception as e:
+            yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+            return
+
+        if CACHE_ENABLED:
+            CACHE.store(key, migrated_content)
+
+        final = build_response(selected_model, code_to_migrate, migrated_content, False)
+        yield json.dumps({'type': 'final', **final}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/models', methods=['GET'])
+def list_models():
+    # List the model names without building their clients
+    return jsonify({'models': MODELS.names(), 'loaded': MODELS.loaded_names()})
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    return jsonify(CACHE.get_stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus text format
+    return Response(METRICS.render(), content_type=METRICS.content_type)
+
+MODELS.warm_up(WARM_UP_MODELS)
+
+# Time taken to import the providers, build the warm-up models and set up the app
+startup_seconds = time.perf_counter() - startup_start_time
+
 if __name__ == "__main__":
+    print(f'Server started in {startup_seconds:.2f} seconds')
     app.run(debug=True)
@@ -0,0 +1,169 @@
+import os
+import asyncio
+import signal
+from quart import Quart, request, jsonify
+from code_migration_api import (
+    MODELS, CACHE, CACHE_ENABLED, PROVIDER_RATE_LIMITS, RATE_LIMIT_MAX_WAIT_SECONDS,
+    MigrationError, build_chain, normalise_output, build_response
+)
+from migration_cache import cache_key
+from rate_limiter import RateLimitExceeded, estimate_tokens
+
+# Async version of the migration API: each request awaits the model instead of holding a worker thread,
+# so one process can keep hundreds of migrations in flight. Run with: python code_migration_asgi.py
+# (or any ASGI server, e.g. hypercorn code_migration_asgi:app)
+app = Quart(__name__)
+
+# Maximum number of migrations in flight before new requests are turned away with 503
+MAX_IN_FLIGHT = int(os.getenv('MAX_IN_FLIGHT', '500'))
+
+# Longest time to wait for in-flight migrations to finish when shutting down
+SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv('SHUTDOWN_TIMEOUT_SECONDS', '60'))
+
+in_flight = 0
+shutting_down = False
+idle = asyncio.Event()
+
+# Migrations currently running, so identical requests await the same model call
+pending_migrations = {}
+
+# Function to wait for the provider's rate limit budget without blocking the event loop
+async def acquire_rate_limit(selected_model, tokens):
+    rate_limiter = PROVIDER_RATE_LIMITS.get(selected_model.split(' - ')[0])
+    if rate_limiter is not None:
+        await rate_limiter.acquire_async(tokens * 2, max_wait=RATE_LIMIT_MAX_WAIT_SECONDS)
+
+# Function to invoke the model asynchronously and return the migrated content
+async def run_migration(selected_model, model, prompt_data, code_to_migrate):
+    await acquire_rate_limit(selected_model, estimate_tokens(prompt_data) + estimate_tokens(code_to_migrate))
+    chain = build_chain(model)
+
+    # Await the chain to migrate the code
+    migrated_code = await chain.ainvoke({'question': prompt_data, 'answer': code_to_migrate})
+    return normalise_output(migrated_code)
+
+# Function to return (migrated content, cache hit), sharing one model call between identical requests
+async def get_or_migrate(selected_model, model, prompt_data, code_to_migrate):
+    if not CACHE_ENABLED:
+        return await run_migration(selected_model, model, prompt_data, code_to_migrate), False
+
+    key = cache_key(selected_model, prompt_data, code_to_migrate)
+    cached_content = await asyncio.to_thread(CACHE.lookup, key)
+    if cached_content is not None:
+        return cached_content, True
+
+    pending = pending_migrations.get(key)
+    if pending is not None:
+        CACHE.count('hits', 'coalesced')
+        return await asyncio.shield(pending), True
+
+    CACHE.count('misses')
+    pending = asyncio.ensure_future(run_migration(selected_model, model, prompt_data, code_to_migrate))
+    pending_migrations[key] = pending
+    try:
+        # Shield the model call so a client disconnecting does not cancel it for the other waiters
+        migrated_content = await asyncio.shield(pending)
+    finally:
+        if pending_migrations.get(key) is pending:
+            del pending_migrations[key]
+
+    await asyncio.to_thread(CACHE.store, key, migrated_content)
+    return migrated_content, False
+
+@app.route('/code-migration', methods=['POST'])
+async def code_migration():
+    global in_flight
+
+    # Turn requests away when shutting down or saturated, so clients back off and retry
+    if shutting_down:
+        return jsonify({'error': 'Server is shutting down'}), 503, {'Retry-After': '5'}
+    if in_flight >= MAX_IN_FLIGHT:
+        return jsonify({'error': 'Server is saturated'}), 503, {'Retry-After': '1'}
+
+    in_flight += 1
+    idle.clear()
+    try:
+        # Parse request data
+        if not request.is_json:
+            return jsonify({'error': 'Expected a JSON request body'}), 415
+        request_data = await request.get_json(silent=True)
+        if not isinstance(request_data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        selected_model = request_data.get('model')
+        prompt_data = request_data.get('prompt')
+        code_to_migrate = request_data.get('code')
+
+        # Initialise the model based on the selected model name above
+        if selected_model not in MODELS:
+            return jsonify({'error': 'Invalid model name'}), 400
+        try:
+            model = await asyncio.to_thread(MODELS.get, selected_model)
+        except Exception as e:
+            return jsonify({'error': f'Model unavailable: {e}'}), 503
+
+        try:
+            migrated_content, cache_hit = await get_or_migrate(selected_model, model, prompt_data, code_to_migrate)
+        except RateLimitExceeded as e:
+            return jsonify({'error': str(e)}), 429, {'Retry-After': str(max(1, int(e.retry_after + 0.5)))}
+        except MigrationError as e:
+            return jsonify({'error': str(e)}), 500
+
+        # Construct response
+        response = build_response(selected_model, code_to_migrate, migrated_content, cache_hit)
+
+        return jsonify(response)
+    finally:
+        in_flight -= 1
+        if in_flight == 0:
+            idle.set()
+
+@app.route('/models', methods=['GET'])
+async def list_models():
+    # List the model names without building their clients
+    return jsonify({'models': MODELS.names(), 'loaded': MODELS.loaded_names()})
+
+@app.route('/cache-stats', methods=['GET'])
+async def cache_stats():
+    return jsonify(CACHE.get_stats())
+
+@app.after_serving
+async def drain_in_flight():
+    global shutting_down
+    # Already set by the shutdown trigger when served by serve_app; set here when run by another ASGI server
+    shutting_down = True
+
+    # Let in-flight migrations finish before the process exits
+    if in_flight:
+        try:
+            await asyncio.wait_for(idle.wait(), timeout=SHUTDOWN_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            app.logger.warning(f'Shutting down with {in_flight} migrations still in flight')
+
+# Function to serve the app with Hypercorn, shutting down gracefully on SIGINT/SIGTERM
+async def serve_app():
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [os.getenv('ASGI_BIND', '127.0.0.1:5000')]
+    config.graceful_timeout = SHUTDOWN_TIMEOUT_SECONDS
+
+    shutdown_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for shutdown_signal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(shutdown_signal, shutdown_event.set)
+        except NotImplementedError:
+            # Signal handlers are not supported by the Windows event loop, Ctrl+C still stops the server
+            pass
+
+    # Turn new requests away as soon as the signal arrives, while Hypercorn waits for open requests to finish
+    async def wait_for_shutdown():
+        global shutting_down
+        await shutdown_event.wait()
+        shutting_down = True
+
+    await serve(app, config, shutdown_trigger=wait_for_shutdown)
+
+if __name__ == "__main__":
+    asyncio.run(serve_app())
@@ -1,11 +1,26 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import subprocess
 import json
 from datetime import datetime
 import re
 import time
+import io
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
+from migration_manifest import MigrationManifest, file_hash, prompt_hash
+from results_store import ResultsStore
+from project_index import ProjectIndex
+from source_chunker import chunk_source, reassemble_chunks
+from verification_pipeline import VerificationPipeline
+from migration_scheduler import MigrationJob, TokenBudgetScheduler, output_token_ratios
+from rate_limiter import estimate_tokens
+from pipeline_tracing import Tracer
 
 # Load environment variables from .env file
 load_dotenv()
@@ -43,54 +58,219 @@ models = [
     # 'Ollama - CodeLlama'
 ]
 
-# Function to extract migrated code based on regex patterns
-def extract_code(response_json):
-    migrated_code = response_json.get('migrated_code', '')
+# Endpoint accepting several files per request
+batch_api_endpoint = os.getenv('BATCH_API_ENDPOINT') or (f'{api_endpoint.rstrip("/")}/batch' if api_endpoint else None)
 
-    if not target_language:
-        # When no target language is specified, ignore content before and after ```
-        code_block_match = re.search(r'```([\s\S]*?)```', migrated_code, re.IGNORECASE)
-        if code_block_match:
-            migrated_code = code_block_match.group(1).strip()
-        else:
-            code_block_match = re.search(r'```([\s\S]*?)```', migrated_code, re.IGNORECASE)
-            if code_block_match:
-                migrated_code = code_block_match.group(1).strip()
-    else:
-        # When target language is specified, ignore content before and after ```
-        code_block_match = re.search(rf'```{target_language}\n([\s\S]*?)```', migrated_code, re.IGNORECASE)
-        if code_block_match:
-            migrated_code = code_block_match.group(1).strip()
-        else:
-            code_block_match = re.search(rf'```{target_language}\n([\s\S]*?)\n```', migrated_code, re.IGNORECASE)
-            if code_block_match:
-                migrated_code = code_block_match.group(1).strip()
+# Endpoint streaming the model output as JSON lines
+stream_api_endpoint = os.getenv('STREAM_API_ENDPOINT') or (f'{api_endpoint.rstrip("/")}/stream' if api_endpoint else None)
 
-    return migrated_code
+# Stream each response and write the file as soon as its code block is complete
+stream_mode = os.getenv('STREAM_MODE', 'false').lower() == 'true'
 
-# Function to extract migrated code with indentation-based approach
-def extract_code_indentation(response_json):
-    migrated_code = ''
+# Send files to the batch endpoint instead of one request per file
+batch_mode = os.getenv('BATCH_MODE', 'false').lower() == 'true'
 
-    if 'migrated_code' in response_json:
-        migrated_code_block = response_json['migrated_code'].strip()
-        code_match = re.search(rf'```{target_language}\n(.+?)\n```', migrated_code_block, re.DOTALL | re.IGNORECASE)
-        if code_match:
-            migrated_code = code_match.group(1).strip()
+# Number of files sent in each batch request
+batch_size = int(os.getenv('BATCH_SIZE', '10'))
 
-    return migrated_code
+# Manifest recording which files have already been migrated, so reruns skip unchanged files
+manifest_path = os.getenv('MANIFEST_PATH', 'output/migration_manifest.jsonl')
+manifest = None
 
-# Combine extraction results from different methods
-def extract_code_combined(response_json):
-    migrated_code_regex = extract_code(response_json)
+# SQLite database recording the response, timing and extraction outcome of every migration
+results_path = os.getenv('RESULTS_PATH', 'output/migration_results.db')
+results_store = None
+
+# Id of the current run, stored with each result
+run_id = None
+
+# Verification stage receiving every written output file (created by main when verification_mode is on)
+verification_pipeline = None
+
+# Migrate every file even if the manifest shows it is unchanged and already migrated (set by --force)
+force_migration = False
+
+# Files larger than this many characters are split into chunks at class/method/function boundaries
+chunk_threshold_chars = int(os.getenv('CHUNK_THRESHOLD_CHARS', '12000'))
+
+# Maximum size of each chunk, not counting the shared import header
+max_chunk_chars = int(os.getenv('MAX_CHUNK_CHARS', '6000'))
+
+# Maximum number of chunks of one file being migrated at the same time
+max_chunk_workers = int(os.getenv('MAX_CHUNK_WORKERS', '4'))
+
+# Timeouts in seconds for connecting to the API and for waiting on its response
+connect_timeout = float(os.getenv('CONNECT_TIMEOUT', '10'))
+read_timeout = float(os.getenv('READ_TIMEOUT', '600'))
+
+# Retries for connection errors, 429 and 502/503/504 responses, with exponential backoff and jitter
+max_retries = int(os.getenv('MAX_RETRIES', '5'))
+
+# Retries after a read timeout or a dropped response; the model may still be working on the first request
+max_read_retries = int(os.getenv('MAX_READ_RETRIES', '1'))
+retry_backoff_factor = float(os.getenv('RETRY_BACKOFF_FACTOR', '1'))
+retry_backoff_jitter = float(os.getenv('RETRY_BACKOFF_JITTER', '1'))
+
+# Send each file to all race_models at once and keep the first valid result
+race_mode = os.getenv('RACE_MODE', 'false').lower() == 'true'
+
+# Models raced against each other in race mode
+race_models = [
+    'VertexAI - PaLM 2',
+    'OpenAI - GPT-4o',
+    # 'VertexAI - Gemini Pro',
+    # 'Ollama - Llama 3'
+]
+
+# Ask a backup model for a file only when its primary model has not answered within hedge_percentile of its past latencies
+hedge_mode = os.getenv('HEDGE_MODE', 'false').lower() == 'true'
+
+# Backup model for each primary model in models
+hedge_models = {
+    'VertexAI - PaLM 2': 'OpenAI - GPT-3.5 Turbo',
+    'VertexAI - Gemini Pro': 'OpenAI - GPT-4o',
+    'Ollama - Llama 3': 'OpenAI - GPT-3.5 Turbo'
+}
+
+hedge_percentile = float(os.getenv('HEDGE_PERCENTILE', '0.95'))
+
+# Hedge delay used until a model has at least hedge_min_samples recorded latencies
+hedge_default_delay = float(os.getenv('HEDGE_DEFAULT_DELAY', '30'))
+hedge_min_samples = int(os.getenv('HEDGE_MIN_SAMPLES', '10'))
+
+# Reject racing results whose brackets do not balance
+race_syntax_check = os.getenv('RACE_SYNTAX_CHECK', 'true').lower() == 'true'
+
+# Check each migrated file with a fast compile/type check while the remaining files are still being migrated
+verification_mode = os.getenv('VERIFICATION_MODE', 'false').lower() == 'true'
+verification_workers = int(os.getenv('VERIFICATION_WORKERS', '2'))
+
+# Per-file check commands by output extension, {file} is replaced with the migrated file path
+# and {worker} with the verification worker number, so parallel checks keep separate build state.
+# To reuse a warm Gradle daemon instead of kotlinc, set KOTLIN_CHECK_COMMAND to e.g. 'gradlew.bat --daemon compileKotlin'.
+verification_commands = {
+    'kt': os.getenv('KOTLIN_CHECK_COMMAND', 'kotlinc -nowarn -d output/verification/classes_{worker} "{file}"'),
+    'ts': os.getenv('TYPESCRIPT_CHECK_COMMAND', 'tsc --noEmit --incremental --tsBuildInfoFile output/verification/tsbuildinfo_{worker} --skipLibCheck "{file}"')
+}
+
+# Final gates run once every file has been migrated
+run_final_tests = os.getenv('RUN_FINAL_TESTS', 'true').lower() == 'true'
+run_final_sonar = os.getenv('RUN_FINAL_SONAR', 'true').lower() == 'true'
+
+# JSONL file for the timing spans of each stage (read, http, extract, write, tests, sonar); empty to disable
+trace_path = os.getenv('TRACE_PATH', 'output/traces/client_traces.jsonl')
+
+# Schedule files largest first by estimated token cost, within each provider's tokens-per-minute budget
+scheduled_mode = os.getenv('SCHEDULED_MODE', 'false').lower() == 'true'
+
+# Migrate each file once with whichever model in models has spare capacity, instead of once per model
+balance_models = os.getenv('BALANCE_MODELS', 'false').lower() == 'true'
+
+# Tokens-per-minute budget per provider for scheduled mode (0 means no limit)
+provider_token_budgets = {
+    'OpenAI': int(os.getenv('OPENAI_TOKENS_PER_MINUTE', '30000')),
+    'VertexAI': int(os.getenv('VERTEXAI_TOKENS_PER_MINUTE', '0')),
+    'Ollama': int(os.getenv('OLLAMA_TOKENS_PER_MINUTE', '0'))
+}
+
+# Index the project first, migrate files after the files they depend on, and give each request
+# the signatures of the project types it uses instead of cross-file rules in every prompt
+project_context_mode = os.getenv('PROJECT_CONTEXT_MODE', 'false').lower() == 'true'
+
+# Maximum characters of signatures added to each prompt
+project_context_max_chars = int(os.getenv('PROJECT_CONTEXT_MAX_CHARS', '4000'))
+
+# Symbol index of the source directories, built by main in project context mode
+project_index = None
+
+# Run migrations concurrently instead of one file at a time
+concurrent_mode = os.getenv('CONCURRENT_MODE', 'true').lower() == 'true'
+
+# Maximum number of files being migrated at the same time
+max_workers = int(os.getenv('MAX_WORKERS', '8'))
+
+# Maximum number of in-flight requests per model (models not listed use the default limit)
+model_concurrency_limits = {
+    'VertexAI - PaLM 2': 4,
+    'VertexAI - Codey': 4,
+    'Ollama - Llama 3': 1,
+    'Ollama - CodeGemma': 1,
+    'Ollama - CodeLlama': 1
+}
+
+# Maximum number of in-flight requests per provider (the part of the model name before ' - ')
+provider_concurrency_limits = {
+    'OpenAI': 8,
+    'VertexAI': 4,
+    'Ollama': 1
+}
+
+default_concurrency_limit = 4
+
+# Opening code fences in model responses: ``` at the start of a line, with the optional language tag after it.
+# Anchoring stops a fence mentioned in prose (e.g. "Use ``` fences") from opening a block.
+opening_code_fence = re.compile(r'(?m)^[ \t]*```[ \t]*([\w+#.-]*)')
+
+# Closing code fences are matched anywhere, as models sometimes end the last line of code with them
+closing_code_fence = re.compile(r'```')
+
+# Language tags accepted for each target language
+language_tags = {
+    'kotlin': ('kotlin', 'kt', 'kts'),
+    'typescript': ('typescript', 'ts', 'tsx'),
+}
+
+# Function to find every fenced code block and its language tag in a single scan of the response.
+# An unterminated fence (e.g. a response cut short) runs to the end of the response.
+def find_code_blocks(response_text):
+    blocks = []
+    position = 0
+
+    while True:
+        opening_match = opening_code_fence.search(response_text, position)
+        if opening_match is None:
+            return blocks
+        block_tag = opening_match.group(1).lower()
 
-    if not migrated_code_regex:
-        migrated_code_indentation = extract_code(response_json)
-        migrated_code_combined = migrated_code_indentation
+        # The code starts on the line after the opening fence
+        line_end = response_text.find('\n', opening_match.end())
+        if line_end == -1:
+            return blocks
+        block_start = line_end + 1
+
+        closing_match = closing_code_fence.search(response_text, block_start)
+        if closing_match is None:
+            blocks.append((block_tag, response_text[block_start:].strip()))
+            return blocks
+
+        blocks.append((block_tag, response_text[block_start:closing_match.start()].strip()))
+        position = closing_match.end()
+
+# Function to get the language tags accepted for the target language
+def target_language_tags():
+    return language_tags.get(target_language.lower(), (target_language.lower(),))
+
+# Function to choose the best code block: the largest block tagged with the target language,
+# then the largest untagged block (or the largest block of any tag when no target language is set)
+def select_code_block(blocks):
+    if target_language:
+        tags = target_language_tags()
+        tagged_blocks = [code for tag, code in blocks if tag in tags and code]
+        if tagged_blocks:
+            return max(tagged_blocks, key=len)
+        untagged_blocks = [code for tag, code in blocks if not tag and code]
     else:
-        migrated_code_combined = migrated_code_regex
+        untagged_blocks = [code for _, code in blocks if code]
+
+    if untagged_blocks:
+        return max(untagged_blocks, key=len)
+    return None
 
-    return migrated_code_combined
+# Function to extract migrated code: the best fenced code block, otherwise the whole response
+def extract_code_combined(response_json):
+    migrated_code = response_json.get('migrated_code', '')
+    code_block = select_code_block(find_code_blocks(migrated_code))
+    return code_block if code_block is not None else migrated_code.strip()
 
 # Map models to the extraction functions
 extraction_functions = {
@@ -105,10 +285,55 @@ extraction_functions = {
     'Ollama - CodeLlama': extract_code_combined
 }
 
+# Function to create the HTTP session shared by all requests, keeping connections alive between files.
+# Migrations are idempotent (and cached by the API), so POST requests are safe to retry.
+# A 500 is a failed migration (e.g. the model raised an error), which a retry would usually only repeat.
+def create_http_session():
+    retry = Retry(
+        total=max_retries,
+        read=max_read_retries,
+        backoff_factor=retry_backoff_factor,
+        backoff_jitter=retry_backoff_jitter,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset(['POST']),
+        respect_retry_after_header=True,
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers * max_chunk_workers, max_retries=retry)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+http_session = create_http_session()
+request_timeout = (connect_timeout, read_timeout)
+
+tracer = Tracer(trace_path, 'client')
+
+# Function to get the headers passing the current trace id to the API, so its spans join the same trace
+def trace_headers():
+    trace_id = tracer.current_trace_id()
+    return {'X-Trace-Id': trace_id} if trace_id else {}
+
 # Timer variables for tracking model execution time
 total_requests = 0
+cache_hits = 0
+skipped_files = 0
 model_times = {}
 
+# Recent response latencies per model, used to choose hedge delays
+model_latencies = {}
+
+# Locks guarding the shared counters and the log file when migrating concurrently
+stats_lock = threading.Lock()
+log_lock = threading.Lock()
+
+# Semaphores limiting in-flight requests, created on first use
+model_semaphores = {}
+provider_semaphores = {}
+semaphore_lock = threading.Lock()
+
 # Function to run SonarQube Scanner for code quality analysis
 def run_sonar_scanner():
     sonar_scanner_command = (
@@ -192,67 +417,191 @@ def run_tests(file_extension):
     print(f'Log file created at: {log_filename}')
     return False
     
+# Function to build the migration prompt
+def build_prompt():
+    # Simple prompt for Java to Kotlin and JavaScript to TypeScript
+    prompt = (
+        f"Migrate the provided {source_language} code to {target_language}."
+    )
+
+    # Complex prompt for Java to Kotlin
+
+    # Class Code
+    # prompt = (
+    #     f"Migrate the provided {source_language} code to {target_language}. Follow these instructions for an error-free migration:\n"
+    #     f"1. Remove the package import from each file for the purposes of this migration.\n"
+    #     f"2. Adjust all other important imports and dependencies from {source_language} to match {target_language}'s syntax and structure.\n"
+    #     f"3. Handle static methods and fields by using {target_language}'s appropriate annotations or constructs to maintain static-like behavior.\n"
+    #     f"4. Adjust access modifiers and collections. Ensure that {source_language}'s access levels (`public`, `protected`, `private`) are correctly translated into {target_language}'s visibility modifiers.\n"
+    #     f"5. Ensure that all mutable properties in {target_language} are declared with `var` instead of `val`.\n"
+    # )
+
+    # App Code
+    # prompt = (
+    #     f"Migrate ALL the provided {source_language} code to {target_language} and keep the functionality the same. Follow these instructions for an error-free migration:\n"
+    #     "\n"
+    #     f"1. Retain all package imports and adapt other imports from {source_language} to {target_language}'s syntax.\n"
+    #     f"2. Handle static methods and fields in {target_language} using `@JvmStatic` and `companion object`.\n"
+    #     f"4. Use `var` for mutable properties in {target_language}.\n"
+    #     f"5. Make all properties and their setters public in {target_language}, regardless of their access level in {source_language}. Ensure that getters and setters do not cause method signature conflicts.\n"
+    #     f"6. Ensure that all function calls are correctly translated from Java to {source_language}. Verify that function invocations and variable assignments are correct and that the syntax matches {source_language}’s expectations.\n"
+    #     f"7. Verify that all referenced classes, methods, and variables are properly migrated and imported. Ensure that functions are invoked properly and variables are used as expected in the {source_language} code.\n"
+    #     f"8. Do not manually define getters and setters. Rely on {source_language}'s autogenerated methods to avoid conflicts.\n"
+    #     "\n"
+    #     f"Provide clear and correctly formatted {target_language} code, avoiding unresolved references, syntax errors, and incorrect function invocations."
+    # )
+
+    # Complex prompts for JavaScript to TypeScript
+    
+    # Class Code
+    # prompt = (
+    #     f"Migrate the provided {source_language} code to {target_language}. Follow these instructions for an error-free migration:\n"
+    #     f"1. If they exist, retain all important imports and dependencies from {source_language}. 
+    #     f"2. Handle type declarations and generics properly. Ensure all types are correctly defined in {target_language}.\n"
+    #     f"3. Adjust syntax differences between {source_language} and {target_language}. Ensure correct usage of language-specific features.\n"
+    #     f"4. For TypeScript, handle type assertions, generics, and private fields accurately. Replace 'private' keyword with '#' for private fields.\n"
+    # )
+
+    # App Code
+    # prompt = (
+    #     f"Migrate the provided {source_language} code to {target_language}. Follow these instructions for an error-free migration:\n"
+    #     f"1. If they exist, retain all important imports and dependencies from {source_language}. Ensure that all relevant import statements and require calls use the format `.../.../src/` at the start of the original paths, for example: ../schemas/user.schema.js migrates to ../../src/schemas/user.schema.ts.\n"
+    #     f"2. Handle type declarations and generics properly. Ensure all types are correctly defined in {target_language}.\n"
+    #     f"3. Adjust syntax differences between {source_language} and {target_language}. Ensure correct usage of language-specific features.\n"
+    #     f"4. Rename 'delete' to 'deleteUser' where applicable.\n"
+    #     f"5. Use `module.exports =` instead of a function name in paginationAndSort.ts.\n"
+    #     f"6. Ensure that the format and naming conventions of the migrated code remain consistent with the original code.\n"
+    # )
+
+    return prompt
+
+# Function to build the prompt for a file, adding the signatures of the project declarations it uses
+def build_file_prompt(file_path, selected_model):
+    prompt = build_prompt()
+    if project_index is None:
+        return prompt
+
+    context = project_index.context_for(file_path, selected_model, project_context_max_chars)
+    if not context:
+        return prompt
+
+    return (
+        f'{prompt}\n'
+        f'The code uses these declarations from other files in the project, shown as signatures only '
+        f'({target_language} unless marked as not migrated yet). Keep the code consistent with them and do not include them in the answer:\n'
+        f'{context}'
+    )
+
+# Function to extract the migrated code from an API response and save it
+def save_migrated_code(file_path, selected_model, response_json, extraction_functions, log_file, written_code=None, extract=True, duration=None,
+                       prompt=None):
+    extraction_function = extraction_functions.get(selected_model)
+    if extraction_function is None:
+        raise ValueError(f'No extraction function found for model: {selected_model}')
+
+    if response_json.get('cache_hit'):
+        record_cache_hit()
+        log_file.write(f'{datetime.now()}: Cache hit for {file_path} using model {selected_model}.\n')
+
+    # Chunked responses are already extracted chunk by chunk
+    with tracer.span('extract', model=selected_model) as attributes:
+        migrated_code = extraction_function(response_json) if extract else response_json['migrated_code']
+        attributes['extracted'] = bool(migrated_code)
+    response_json['migrated_code'] = migrated_code
+
+    if not migrated_code:
+        log_file.write(f'{datetime.now()}: No valid migrated code for {file_path} using model {selected_model}.\n')
+        record_result(file_path, selected_model, 'empty', response_json=response_json, duration=duration, prompt=prompt)
+        return False
+
+    with tracer.span('write', model=selected_model):
+        # Skip rewriting code that was already written while streaming
+        if migrated_code != written_code:
+            output_file_path = write_migrated_code(file_path, migrated_code, log_file)
+        else:
+            output_file_path = output_path_for(file_path)
+        record_result(file_path, selected_model, 'extracted', output_path=output_file_path, response_json=response_json, duration=duration,
+                      prompt=prompt)
+
+    # Files that depend on this one are given its migrated signatures
+    if project_index is not None:
+        project_index.record_migrated(file_path, selected_model, migrated_code)
+
+    return True
+
+# Function to get the output path for the migrated code of a source file
+def output_path_for(file_path):
+    file_name_without_extension = os.path.splitext(os.path.basename(file_path))[0]
+    target_language_extension = language_extensions.get(target_language, 'txt')
+
+    # Get the name of the last directory name from the source path
+    source_directory = os.path.dirname(file_path)
+    last_directory_name = os.path.basename(source_directory)
+
+    # Define the output path based on the last directory name
+    output_directory = os.path.join('output', 'src', last_directory_name)
+    return os.path.join(output_directory, file_name_without_extension + '.' + target_language_extension)
+
+# Function to write the migrated code to the output directory
+def write_migrated_code(file_path, migrated_code, log_file):
+    output_file_path = output_path_for(file_path)
+    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+    
+    with open(output_file_path, 'w', encoding='utf-8') as file:
+        file.write(migrated_code)
+    
+    log_file.write(f'{datetime.now()}: Migrated code for {file_path} saved to {output_file_path}.\n')
+
+    if verification_pipeline is not None:
+        verification_pipeline.submit(output_file_path)
+
+    return output_file_path
+
+# Function to add the outcome of a migration to the results store, with the hash of the prompt sent for the file
+# (the per-file response JSON files can be recreated with: python results_store.py export)
+def record_result(file_path, selected_model, extraction, output_path=None, response_json=None, duration=None, error=None, prompt=None):
+    if results_store is None:
+        return
+
+    results_store.record(
+        run_id,
+        selected_model,
+        prompt_hash(prompt) if prompt is not None else None,
+        file_path,
+        extraction,
+        output_path=output_path,
+        cache_hit=(response_json or {}).get('cache_hit', False),
+        duration=duration,
+        error=error,
+        response_json=response_json
+    )
+
+# Function to add the time taken for a file to the model execution times
+def record_model_time(selected_model, file_path, model_execution_time, log_file):
+    with stats_lock:
+        model_times[selected_model] = model_times.get(selected_model, 0) + model_execution_time
+    log_file.write(f'{datetime.now()}: Model {selected_model} processed {file_path}. Time taken: {model_execution_time:.2f} seconds\n')
+
+# Function to log an error for a file
+def log_migration_error(file_path, selected_model, e, log_file, duration=None, prompt=None):
+    error_message = f'{datetime.now()}: Error for {file_path} using model {selected_model}: {e}'
+    log_file.write(error_message + '\n')
+    if hasattr(e, 'response') and e.response is not None:
+        log_file.write(f'{e.response.text}\n')
+
+    record_result(file_path, selected_model, 'error', duration=duration, error=str(e), prompt=prompt)
+
 # Function to migrate code and handle errors
 def migrate_code(file_path, selected_model, extraction_functions, log_file):
     model_start_time = time.time()
+    prompt = None
     
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            code_to_migrate = file.read()
-
-        # Simple prompt for Java to Kotlin and JavaScript to TypeScript
-        prompt = (
-            f"Migrate the provided {source_language} code to {target_language}."
-        )
-
-        # Complex prompt for Java to Kotlin
-
-        # Class Code
-        # prompt = (
-        #     f"Migrate the provided {source_language} code to {target_language}. Follow these instructions for an error-free migration:\n"
-        #     f"1. Remove the package import from each file for the purposes of this migration.\n"
-        #     f"2. Adjust all other important imports and dependencies from {source_language} to match {target_language}'s syntax and structure.\n"
-        #     f"3. Handle static methods and fields by using {target_language}'s appropriate annotations or constructs to maintain static-like behavior.\n"
-        #     f"4. Adjust access modifiers and collections. Ensure that {source_language}'s access levels (`public`, `protected`, `private`) are correctly translated into {target_language}'s visibility modifiers.\n"
-        #     f"5. Ensure that all mutable properties in {target_language} are declared with `var` instead of `val`.\n"
-        # )
-
-        # App Code
-        # prompt = (
-        #     f"Migrate ALL the provided {source_language} code to {target_language} and keep the functionality the same. Follow these instructions for an error-free migration:\n"
-        #     "\n"
-        #     f"1. Retain all package imports and adapt other imports from {source_language} to {target_language}'s syntax.\n"
-        #     f"2. Handle static methods and fields in {target_language} using `@JvmStatic` and `companion object`.\n"
-        #     f"4. Use `var` for mutable properties in {target_language}.\n"
-        #     f"5. Make all properties and their setters public in {target_language}, regardless of their access level in {source_language}. Ensure that getters and setters do not cause method signature conflicts.\n"
-        #     f"6. Ensure that all function calls are correctly translated from Java to {source_language}. Verify that function invocations and variable assignments are correct and that the syntax matches {source_language}’s expectations.\n"
-        #     f"7. Verify that all referenced classes, methods, and variables are properly migrated and imported. Ensure that functions are invoked properly and variables are used as expected in the {source_language} code.\n"
-        #     f"8. Do not manually define getters and setters. Rely on {source_language}'s autogenerated methods to avoid conflicts.\n"
-        #     "\n"
-        #     f"Provide clear and correctly formatted {target_language} code, avoiding unresolved references, syntax errors, and incorrect function invocations."
-        # )
-
-        # Complex prompts for JavaScript to TypeScript
-        
-        # Class Code
-        # prompt = (
-    #         f"Migrate the provided {source_language} code to {target_language}. Follow these instructions for an error-free migration:\n"
-    #         f"1. If they exist, retain all important imports and dependencies from {source_language}. 
-    #         f"2. Handle type declarations and generics properly. Ensure all types are correctly defined in {target_language}.\n"
-    #         f"3. Adjust syntax differences between {source_language} and {target_language}. Ensure correct usage of language-specific features.\n"
-    #         f"4. For TypeScript, handle type assertions, generics, and private fields accurately. Replace 'private' keyword with '#' for private fields.\n"
-        # )
-
-        # App Code
-        # prompt = (
-        #     f"Migrate the provided {source_language} code to {target_language}. Follow these instructions for an error-free migration:\n"
-        #     f"1. If they exist, retain all important imports and dependencies from {source_language}. Ensure that all relevant import statements and require calls use the format `.../.../src/` at the start of the original paths, for example: ../schemas/user.schema.js migrates to ../../src/schemas/user.schema.ts.\n"
-        #     f"2. Handle type declarations and generics properly. Ensure all types are correctly defined in {target_language}.\n"
-        #     f"3. Adjust syntax differences between {source_language} and {target_language}. Ensure correct usage of language-specific features.\n"
-        #     f"4. Rename 'delete' to 'deleteUser' where applicable.\n"
-        #     f"5. Use `module.exports =` instead of a function name in paginationAndSort.ts.\n"
-        #     f"6. Ensure that the format and naming conventions of the migrated code remain consistent with the original code.\n"
-        # )
+        with tracer.span('read', model=selected_model):
+            with open(file_path, 'r', encoding='utf-8') as file:
+                code_to_migrate = file.read()
+
+        prompt = build_file_prompt(file_path, selected_model)
 
         # Log the prompt used for migration
         log_file.write(f'{datetime.now()}: Using prompt: {prompt}\n')
@@ -263,115 +612,922 @@ def migrate_code(file_path, selected_model, extraction_functions, log_file):
             'code': code_to_migrate
         }
 
-        response = requests.post(api_endpoint, json=payload)
+        with tracer.span('http', model=selected_model) as attributes:
+            response = http_session.post(api_endpoint, json=payload, timeout=request_timeout, headers=trace_headers())
+            attributes['status_code'] = response.status_code
+            response.raise_for_status()
+
+        if save_migrated_code(file_path, selected_model, response.json(), extraction_functions, log_file,
+                              duration=time.time() - model_start_time, prompt=prompt):
+            record_model_time(selected_model, file_path, time.time() - model_start_time, log_file)
+            return True
+        return False
+    except Exception as e:
+        log_migration_error(file_path, selected_model, e, log_file, duration=time.time() - model_start_time, prompt=prompt)
+        return False
+
+# Function to migrate one chunk of a file and return its extracted code
+def migrate_chunk(chunk_code, chunk_number, chunk_count, selected_model, prompt, extraction_function, trace_id=None):
+    chunk_prompt = (
+        f'{prompt}\n'
+        f'This is part {chunk_number} of {chunk_count} of a larger file. The imports are included for context. '
+        f'Migrate only the code shown and do not add code from the other parts.'
+    )
+    payload = {
+        'model': selected_model,
+        'prompt': chunk_prompt,
+        'code': chunk_code
+    }
+
+    # Chunks run on worker threads, so join the file's trace explicitly
+    with tracer.span('http', trace_id=trace_id, model=selected_model, chunk=chunk_number) as attributes:
+        response = http_session.post(api_endpoint, json=payload, timeout=request_timeout, headers=trace_headers())
+        attributes['status_code'] = response.status_code
         response.raise_for_status()
+    response_json = response.json()
+
+    migrated_chunk = extraction_function(response_json)
+    if not migrated_chunk:
+        raise ValueError(f'No valid migrated code for part {chunk_number} of {chunk_count}')
+
+    return migrated_chunk, response_json.get('cache_hit', False)
+
+# Function to migrate a large file in chunks and save the reassembled code
+def migrate_code_chunked(file_path, selected_model, extraction_functions, log_file):
+    model_start_time = time.time()
+    prompt = None
+
+    try:
+        with tracer.span('read', model=selected_model):
+            with open(file_path, 'r', encoding='utf-8') as file:
+                code_to_migrate = file.read()
 
         extraction_function = extraction_functions.get(selected_model)
         if extraction_function is None:
             raise ValueError(f'No extraction function found for model: {selected_model}')
 
-        response_json = response.json()
-        migrated_code = extraction_function(response_json)
-        response_json['migrated_code'] = migrated_code
+        prompt = build_file_prompt(file_path, selected_model)
 
-        if migrated_code:
-            file_name_without_extension = os.path.splitext(os.path.basename(file_path))[0]
-            target_language_extension = language_extensions.get(target_language, 'txt')
+        # Log the prompt used for migration
+        log_file.write(f'{datetime.now()}: Using prompt: {prompt}\n')
 
-            # Get the name of the last directory name from the source path
-            source_directory = os.path.dirname(file_path)
-            last_directory_name = os.path.basename(source_directory)
+        header, chunks = chunk_source(code_to_migrate, max_chunk_chars)
+        log_file.write(f'{datetime.now()}: Split {file_path} into {len(chunks)} chunks.\n')
 
-            # Define the output path based on the last directory name
-            output_directory = os.path.join('output', 'src', last_directory_name)
-            os.makedirs(output_directory, exist_ok=True)
-            
-            output_file_path = os.path.join(output_directory, file_name_without_extension + '.' + target_language_extension)
-            with open(output_file_path, 'w', encoding='utf-8') as file:
-                file.write(migrated_code)
-            
-            log_file.write(f'{datetime.now()}: Migrated code for {file_path} saved to {output_file_path}.\n')
+        # The chunk workers run in other threads, so pass them this file's trace id
+        trace_id = tracer.current_trace_id()
 
-            json_directory = os.path.join('output', 'json', 'src', last_directory_name)
-            os.makedirs(json_directory, exist_ok=True)
-            
-            json_file_path = os.path.join(json_directory, f'response_{file_name_without_extension}.json')
-            with open(json_file_path, 'w', encoding='utf-8') as json_file:
-                json.dump(response_json, json_file, indent=4)
-            
-            log_file.write(f'{datetime.now()}: Response JSON for {file_path} saved to {json_file_path}.\n')
+        # The caller holds one model and provider slot for this file, which covers one chunk request at a time.
+        # Take whatever other slots are free (up to max_chunk_workers in total) to migrate more chunks at once.
+        extra_slots = 0
+        while extra_slots < min(max_chunk_workers, len(chunks)) - 1 and try_acquire_limits(selected_model):
+            extra_slots += 1
 
-            model_execution_time = time.time() - model_start_time
-            model_times[selected_model] = model_times.get(selected_model, 0) + model_execution_time
-            log_file.write(f'{datetime.now()}: Model {selected_model} processed {file_path}. Time taken: {model_execution_time:.2f} seconds\n')
+        try:
+            # Send the shared header with every chunk and migrate the chunks concurrently
+            with ThreadPoolExecutor(max_workers=1 + extra_slots) as executor:
+                futures = [
+                    executor.submit(migrate_chunk, f'{header}\n\n{chunk["code"].strip()}' if header else chunk['code'].strip(),
+                                    chunk_number, len(chunks), selected_model, prompt, extraction_function, trace_id)
+                    for chunk_number, chunk in enumerate(chunks, start=1)
+                ]
+                results = [future.result() for future in futures]
+        finally:
+            for _ in range(extra_slots):
+                release_limits(selected_model)
 
+        response_json = {
+            'original_code': code_to_migrate.strip(),
+            'migrated_code': reassemble_chunks(chunks, [migrated_chunk for migrated_chunk, _ in results]),
+            'model_used': selected_model,
+            'cache_hit': all(cache_hit for _, cache_hit in results),
+            'chunks': len(chunks)
+        }
+
+        # Each chunk prompt is this file prompt plus the chunk's position, so the file prompt is recorded
+        if save_migrated_code(file_path, selected_model, response_json, extraction_functions, log_file, extract=False,
+                              duration=time.time() - model_start_time, prompt=prompt):
+            record_model_time(selected_model, file_path, time.time() - model_start_time, log_file)
             return True
-        else:
-            log_file.write(f'{datetime.now()}: No valid migrated code for {file_path} using model {selected_model}.\n')
-            return False
+        return False
     except Exception as e:
-        error_message = f'{datetime.now()}: Error for {file_path} using model {selected_model}: {e}'
-        log_file.write(error_message + '\n')
-        if hasattr(e, 'response') and e.response is not None:
-            log_file.write(f'{e.response.text}\n')
+        log_migration_error(file_path, selected_model, e, log_file, duration=time.time() - model_start_time, prompt=prompt)
         return False
 
-# Function to migrate all .java and .js files from a directory
-def migrate_files_from_directory(directory, selected_model, extraction_functions, log_file):
+# Class to find the first code block in the target language (or untagged) in a response while it is still streaming.
+# Fences are matched like find_code_blocks: opening fences at the start of a line, closing fences anywhere.
+class StreamingCodeExtractor:
+    def __init__(self):
+        self.text = ''
+        self.search_from = 0
+        self.code_start = None
+        self.code_tag = None
+        self.code = None
+
+    # Add a streamed token and return the code block once its closing fence has arrived
+    def feed(self, token):
+        if self.code is not None:
+            return None
+
+        self.text += token
+
+        while True:
+            if self.code_start is None:
+                opening_match = opening_code_fence.search(self.text, self.search_from)
+                if opening_match is None:
+                    # Only rescan the last unfinished line, as a fence can be split across tokens
+                    self.search_from = max(self.search_from, self.text.rfind('\n') + 1)
+                    return None
+
+                # Wait for the whole opening line, so the language tag is complete
+                line_end = self.text.find('\n', opening_match.end())
+                if line_end == -1:
+                    self.search_from = opening_match.start()
+                    return None
+
+                self.code_tag = opening_match.group(1).lower()
+                self.code_start = line_end + 1
+                self.search_from = self.code_start
+
+            closing_match = closing_code_fence.search(self.text, self.search_from)
+            if closing_match is None:
+                # Keep the last two characters, which may be the start of a closing fence
+                self.search_from = max(self.code_start, len(self.text) - 2)
+                return None
+
+            code = self.text[self.code_start:closing_match.start()].strip()
+            self.code_start = None
+            self.search_from = closing_match.end()
+
+            if code and (not target_language or not self.code_tag or self.code_tag in target_language_tags()):
+                self.code = code
+                return code
+
+# Function to migrate code through the streaming endpoint and handle errors
+def migrate_code_streaming(file_path, selected_model, extraction_functions, log_file):
+    model_start_time = time.time()
+    prompt = None
+
+    try:
+        with tracer.span('read', model=selected_model):
+            with open(file_path, 'r', encoding='utf-8') as file:
+                code_to_migrate = file.read()
+
+        prompt = build_file_prompt(file_path, selected_model)
+
+        # Log the prompt used for migration
+        log_file.write(f'{datetime.now()}: Using prompt: {prompt}\n')
+
+        payload = {
+            'model': selected_model,
+            'prompt': prompt,
+            'code': code_to_migrate
+        }
+
+        extractor = StreamingCodeExtractor()
+        streamed_code = None
+        response_json = None
+
+        with tracer.span('http_stream', model=selected_model) as attributes, \
+                http_session.post(stream_api_endpoint, json=payload, stream=True, timeout=request_timeout, headers=trace_headers()) as response:
+            attributes['status_code'] = response.status_code
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+
+                frame = json.loads(line)
+                if frame['type'] == 'token':
+                    # Write the file as soon as the code block is complete
+                    completed_code = extractor.feed(frame['content'])
+                    if completed_code:
+                        write_migrated_code(file_path, completed_code, log_file)
+                        streamed_code = completed_code
+                        attributes['code_complete_seconds'] = time.time() - model_start_time
+                elif frame['type'] == 'error':
+                    raise ValueError(frame['error'])
+                elif frame['type'] == 'final':
+                    response_json = {key: value for key, value in frame.items() if key != 'type'}
+
+        if response_json is None:
+            raise ValueError('Stream ended without a final frame')
+
+        # Save the full response, rewriting the file only if the full extraction differs
+        if save_migrated_code(file_path, selected_model, response_json, extraction_functions, log_file, written_code=streamed_code,
+                              duration=time.time() - model_start_time, prompt=prompt):
+            record_model_time(selected_model, file_path, time.time() - model_start_time, log_file)
+            return True
+        return False
+    except Exception as e:
+        log_migration_error(file_path, selected_model, e, log_file, duration=time.time() - model_start_time, prompt=prompt)
+        return False
+
+# Function to migrate a file in chunks, with the streaming endpoint or with the regular endpoint
+def migrate_file(file_path, selected_model, extraction_functions, log_file):
+    # Root span of the file's trace, the stage spans inside each migrate function are its children
+    with tracer.span('migrate_file', file=file_path, model=selected_model) as attributes:
+        if os.path.getsize(file_path) > chunk_threshold_chars:
+            attributes['path'] = 'chunked'
+            result = migrate_code_chunked(file_path, selected_model, extraction_functions, log_file)
+        elif stream_mode:
+            attributes['path'] = 'stream'
+            result = migrate_code_streaming(file_path, selected_model, extraction_functions, log_file)
+        else:
+            attributes['path'] = 'single'
+            result = migrate_code(file_path, selected_model, extraction_functions, log_file)
+        attributes['succeeded'] = result
+
+    record_manifest_entry(file_path, selected_model, result)
+    return result
+
+# Function to migrate a batch of files with one request to the batch endpoint
+def migrate_batch(file_paths, selected_model, extraction_functions, log_file):
+    batch_start_time = time.time()
+    successes = 0
+
+    prompt = build_prompt()
+    log_file.write(f'{datetime.now()}: Using prompt: {prompt}\n')
+
+    batch_files = []
+    items = []
+    for file_path in file_paths:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                code_to_migrate = file.read()
+        except Exception as e:
+            log_migration_error(file_path, selected_model, e, log_file)
+            continue
+
+        batch_files.append(file_path)
+        items.append({
+            'model': selected_model,
+            'prompt': prompt,
+            'code': code_to_migrate
+        })
+
+    if not items:
+        return successes
+
+    try:
+        response = http_session.post(batch_api_endpoint, json={'items': items}, timeout=request_timeout)
+        response.raise_for_status()
+        results = response.json()['results']
+    except Exception as e:
+        for file_path in batch_files:
+            log_migration_error(file_path, selected_model, e, log_file, duration=time.time() - batch_start_time, prompt=prompt)
+            record_manifest_entry(file_path, selected_model, False)
+        return successes
+
+    # Share the batch time evenly between its files
+    model_execution_time = (time.time() - batch_start_time) / len(batch_files)
+
+    for file_path, response_json in zip(batch_files, results):
+        succeeded = False
+        try:
+            if 'error' in response_json:
+                raise ValueError(response_json['error'])
+
+            if save_migrated_code(file_path, selected_model, response_json, extraction_functions, log_file,
+                                  duration=model_execution_time, prompt=prompt):
+                record_model_time(selected_model, file_path, model_execution_time, log_file)
+                successes += 1
+                succeeded = True
+        except Exception as e:
+            log_migration_error(file_path, selected_model, e, log_file, duration=model_execution_time, prompt=prompt)
+
+        record_manifest_entry(file_path, selected_model, succeeded)
+
+    return successes
+
+# Function to count a successfully processed request
+def record_request():
+    global total_requests
+    with stats_lock:
+        total_requests += 1
+
+# Function to count a response served from the API cache
+def record_cache_hit():
+    global cache_hits
+    with stats_lock:
+        cache_hits += 1
+
+# Function to find all .java and .js files in a directory
+def find_source_files(directory):
     for root, _, files in os.walk(directory):
         for file in files:
             if file.endswith('.java') or file.endswith('.js'):
-                file_path = os.path.join(root, file)
-                if migrate_code(file_path, selected_model, extraction_functions, log_file):
-                    global total_requests
-                    total_requests += 1
+                yield os.path.join(root, file)
+
+# Function to find the source files in a directory that still need migrating with a model
+def pending_source_files(directory, selected_model, log_file):
+    global skipped_files
+    prompt = build_prompt()
+
+    for file_path in find_source_files(directory):
+        if is_file_complete(file_path, selected_model, prompt):
+            with stats_lock:
+                skipped_files += 1
+            with log_lock:
+                log_file.write(f'{datetime.now()}: Skipping unchanged {file_path} for model {selected_model}.\n')
+            continue
+        yield file_path
+
+# Function to check the manifest for an unchanged file already migrated with a model
+def is_file_complete(file_path, selected_model, prompt):
+    if manifest is None or force_migration:
+        return False
+    try:
+        return manifest.is_complete(selected_model, prompt, file_path, file_hash(file_path))
+    except OSError:
+        return False
+
+# Function to record the outcome of a file in the manifest
+def record_manifest_entry(file_path, selected_model, succeeded):
+    if manifest is None:
+        return
+
+    try:
+        source_hash = file_hash(file_path)
+    except OSError:
+        return
+
+    status = 'succeeded' if succeeded else 'failed'
+    output_path = output_path_for(file_path) if succeeded else None
+    manifest.record(selected_model, build_prompt(), file_path, source_hash, status, output_path)
+
+# Function to get (or create) the semaphore limiting in-flight requests for a model or provider
+def get_semaphore(semaphores, key, limits):
+    with semaphore_lock:
+        if key not in semaphores:
+            semaphores[key] = threading.BoundedSemaphore(limits.get(key, default_concurrency_limit))
+        return semaphores[key]
+
+# Function to get the provider and model semaphores for a model
+def model_limits(selected_model):
+    provider = selected_model.split(' - ')[0]
+    provider_semaphore = get_semaphore(provider_semaphores, provider, provider_concurrency_limits)
+    model_semaphore = get_semaphore(model_semaphores, selected_model, model_concurrency_limits)
+    return provider_semaphore, model_semaphore
+
+# Function to take a slot for a model and its provider without waiting, returning False when either is full
+def try_acquire_limits(selected_model):
+    provider_semaphore, model_semaphore = model_limits(selected_model)
+
+    # Always acquire the provider semaphore before the model semaphore to avoid deadlocks
+    if not provider_semaphore.acquire(blocking=False):
+        return False
+    if not model_semaphore.acquire(blocking=False):
+        provider_semaphore.release()
+        return False
+    return True
+
+def release_limits(selected_model):
+    provider_semaphore, model_semaphore = model_limits(selected_model)
+    model_semaphore.release()
+    provider_semaphore.release()
+
+# Function to wait for a slot for a model and its provider, giving up (and returning False) once stop_event is set
+def acquire_limits_until(selected_model, stop_event, poll_seconds=0.1):
+    provider_semaphore, model_semaphore = model_limits(selected_model)
+
+    while not provider_semaphore.acquire(timeout=poll_seconds):
+        if stop_event.is_set():
+            return False
+    while not model_semaphore.acquire(timeout=poll_seconds):
+        if stop_event.is_set():
+            provider_semaphore.release()
+            return False
+    return True
+
+# Function to migrate a file, writing its log lines in one block
+def migrate_code_buffered(file_path, selected_model, extraction_functions, log_file):
+    # Buffer the log lines for this file so they are not interleaved with other files
+    file_log = io.StringIO()
+    result = migrate_file(file_path, selected_model, extraction_functions, file_log)
+
+    with log_lock:
+        log_file.write(file_log.getvalue())
+        log_file.flush()
+
+    return result
+
+# Function to migrate a file within the model and provider limits, waiting for a free slot
+def migrate_code_limited(file_path, selected_model, extraction_functions, log_file):
+    provider_semaphore, model_semaphore = model_limits(selected_model)
+
+    # Always acquire the provider semaphore before the model semaphore to avoid deadlocks
+    with provider_semaphore, model_semaphore:
+        return migrate_code_buffered(file_path, selected_model, extraction_functions, log_file)
+
+# Function to run a job that was started with its model's slot already taken, then free the slot
+def run_limited_job(selected_model, function, args):
+    try:
+        return function(*args)
+    finally:
+        release_limits(selected_model)
+
+# Function to run jobs on max_workers threads, handing a job to a worker only once its model and provider have a free slot.
+# Jobs for a busy model wait in their model's queue instead of holding workers that other models could use.
+# Each job is (model, function, args); on_finished(job, result) may return more jobs to queue.
+def run_limited_jobs(jobs, on_finished):
+    queues = {}
+    for job in jobs:
+        queues.setdefault(job[0], deque()).append(job)
+
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while running or any(queues.values()):
+            # Start the queued jobs of every model with spare capacity, in their queued order
+            for selected_model, queue in queues.items():
+                while queue and len(running) < max_workers and try_acquire_limits(selected_model):
+                    job = queue.popleft()
+                    running[executor.submit(run_limited_job, *job)] = job
+
+            # Slots can also be freed outside this pool (e.g. by hedged backups), so check the queues again periodically
+            done, _ = wait(running, timeout=0.1, return_when=FIRST_COMPLETED) if running else (set(), None)
+            if not running:
+                time.sleep(0.1)
+
+            for future in done:
+                job = running.pop(future)
+                for next_job in on_finished(job, future.result()) or []:
+                    queues.setdefault(next_job[0], deque()).append(next_job)
+
+# Function to count a finished job that migrated its file
+def record_finished_job(job, result):
+    if result:
+        record_request()
+
+# Function to migrate all .java and .js files from a directory, one at a time
+def migrate_files_from_directory(directory, selected_model, extraction_functions, log_file):
+    for file_path in pending_source_files(directory, selected_model, log_file):
+        # Take the model's slot like the concurrent drivers, so chunked files stay within its limits
+        if migrate_code_limited(file_path, selected_model, extraction_functions, log_file):
+            record_request()
+
+# Function to migrate all .java and .js files from the source directories with every model concurrently
+def migrate_files_concurrently(source_directories, models, extraction_functions, log_file):
+    jobs = []
+    for selected_model in models:
+        log_file.write(f'Running model: {selected_model}\n')
+        for source_directory in source_directories:
+            for file_path in pending_source_files(source_directory, selected_model, log_file):
+                jobs.append((selected_model, migrate_code_buffered, (file_path, selected_model, extraction_functions, log_file)))
+
+    run_limited_jobs(jobs, record_finished_job)
+
+# Function to migrate a batch of files, writing its log lines in one block
+def migrate_batch_buffered(file_paths, selected_model, extraction_functions, log_file):
+    batch_log = io.StringIO()
+    successes = migrate_batch(file_paths, selected_model, extraction_functions, batch_log)
+
+    with log_lock:
+        log_file.write(batch_log.getvalue())
+        log_file.flush()
+
+    return successes
+
+# Function to migrate all .java and .js files from the source directories in batches of batch_size files
+def migrate_files_in_batches(source_directories, models, extraction_functions, log_file):
+    with ThreadPoolExecutor(max_workers=max_workers if concurrent_mode else 1) as executor:
+        futures = []
+        for selected_model in models:
+            log_file.write(f'Running model: {selected_model}\n')
+            file_paths = [file_path for source_directory in source_directories for file_path in pending_source_files(source_directory, selected_model, log_file)]
+            for batch_start in range(0, len(file_paths), batch_size):
+                batch = file_paths[batch_start:batch_start + batch_size]
+                futures.append(executor.submit(migrate_batch_buffered, batch, selected_model, extraction_functions, log_file))
+
+        for future in as_completed(futures):
+            for _ in range(future.result()):
+                record_request()
+
+# String literals and comments, removed before checking that brackets balance
+literals_and_comments = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`|//[^\n]*|/\*[\s\S]*?\*/')
+
+# Function to run a quick syntax sanity check: all brackets in the code are balanced
+def brackets_balanced(code):
+    closing_brackets = {')': '(', ']': '[', '}': '{'}
+    stack = []
+    for char in literals_and_comments.sub('', code):
+        if char in '([{':
+            stack.append(char)
+        elif char in closing_brackets:
+            if not stack or stack.pop() != closing_brackets[char]:
+                return False
+    return not stack
+
+# Function to record a model's response latency
+def record_latency(selected_model, latency):
+    with stats_lock:
+        model_latencies.setdefault(selected_model, deque(maxlen=200)).append(latency)
+
+# Function to get how long to wait for a model before asking its backup
+def hedge_delay(selected_model):
+    with stats_lock:
+        latencies = sorted(model_latencies.get(selected_model, ()))
+    if len(latencies) < hedge_min_samples:
+        return hedge_default_delay
+    return latencies[min(len(latencies) - 1, int(hedge_percentile * len(latencies)))]
+
+# Function to run one model's attempt in a race, returning (model, latency, response_json, outcome)
+def race_attempt(file_path, selected_model, prompt, code_to_migrate, extraction_functions, delay, winner_found, attempt_finished,
+                 limits_held=False, trace_id=None):
+    # A hedged attempt waits out its delay, but starts early once an earlier attempt fails or returns no valid code
+    if delay:
+        attempt_finished.wait(delay)
+    if winner_found.is_set():
+        return selected_model, None, None, 'not needed'
+
+    # The race's first model already has its slot, taken when the race was started.
+    # Other models stop waiting for a slot once the race is won, so a busy model is not asked for a discarded answer.
+    if not limits_held and not acquire_limits_until(selected_model, winner_found):
+        return selected_model, None, None, 'not needed'
+
+    attempt_start_time = time.time()
+    try:
+        # The race may have been won while this attempt waited for its slot
+        if winner_found.is_set():
+            return selected_model, None, None, 'not needed'
+
+        payload = {
+            'model': selected_model,
+            'prompt': prompt,
+            'code': code_to_migrate
+        }
+        # Attempts run on worker threads, so join the file's trace explicitly
+        with tracer.span('http', trace_id=trace_id, model=selected_model) as attributes:
+            response = http_session.post(api_endpoint, json=payload, timeout=request_timeout, headers=trace_headers())
+            attributes['status_code'] = response.status_code
+            response.raise_for_status()
+        response_json = response.json()
+    except Exception as e:
+        return selected_model, time.time() - attempt_start_time, None, f'error: {e}'
+    finally:
+        if not limits_held:
+            release_limits(selected_model)
+
+    latency = time.time() - attempt_start_time
+    record_latency(selected_model, latency)
+
+    extraction_function = extraction_functions.get(selected_model)
+    migrated_code = extraction_function(dict(response_json)) if extraction_function else ''
+    if not migrated_code:
+        return selected_model, latency, None, 'no code'
+    if race_syntax_check and not brackets_balanced(migrated_code):
+        return selected_model, latency, None, 'failed syntax check'
+
+    return selected_model, latency, response_json, 'valid'
+
+# Function to send a file to several models and save the first valid result.
+# Each entrant is (model, delay in seconds before it is asked); the remaining attempts are ignored once one wins.
+# held_model is a model whose slot the caller holds for this race, so its attempt is finished before returning.
+def migrate_code_racing(file_path, entrants, extraction_functions, log_file, held_model=None):
+    model_start_time = time.time()
+    prompt = None
+
+    try:
+        with tracer.span('read'):
+            with open(file_path, 'r', encoding='utf-8') as file:
+                code_to_migrate = file.read()
+
+        prompt = build_prompt()
+
+        # Log the prompt used for migration
+        log_file.write(f'{datetime.now()}: Using prompt: {prompt}\n')
+
+        winner_found = threading.Event()
+        attempt_finished = threading.Event()
+        trace_id = tracer.current_trace_id()
+        winner = None
+        outcomes = {}
+
+        executor = ThreadPoolExecutor(max_workers=len(entrants))
+        futures = []
+        try:
+            futures = [
+                executor.submit(race_attempt, file_path, selected_model, prompt, code_to_migrate, extraction_functions, delay, winner_found,
+                                attempt_finished, selected_model == held_model, trace_id)
+                for selected_model, delay in entrants
+            ]
+            for future in as_completed(futures):
+                selected_model, latency, response_json, outcome = future.result()
+                outcomes[selected_model] = (latency, outcome)
+                if outcome == 'valid':
+                    winner = (selected_model, latency, response_json)
+                    winner_found.set()
+                    break
+                attempt_finished.set()
+        finally:
+            # Do not wait for the slower models, except the one using the caller's slot
+            winner_found.set()
+            attempt_finished.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            wait([future for future, (selected_model, _) in zip(futures, entrants) if selected_model == held_model])
+
+        for selected_model, _ in entrants:
+            latency, outcome = outcomes.get(selected_model, (None, 'ignored'))
+            latency_text = f'{latency:.2f} seconds' if latency is not None else 'no response'
+            log_file.write(f'{datetime.now()}: Race for {file_path}: {selected_model} {outcome} ({latency_text}).\n')
+
+        if winner is None:
+            log_file.write(f'{datetime.now()}: No valid migrated code for {file_path} from any racing model.\n')
+            return False
+
+        winning_model, winning_latency, response_json = winner
+        log_file.write(f'{datetime.now()}: Model {winning_model} won the race for {file_path} in {winning_latency:.2f} seconds.\n')
+        response_json['race'] = {
+            selected_model: {'latency': latency, 'outcome': outcome}
+            for selected_model, (latency, outcome) in outcomes.items()
+        }
+
+        if save_migrated_code(file_path, winning_model, response_json, extraction_functions, log_file,
+                              duration=time.time() - model_start_time, prompt=prompt):
+            record_model_time(winning_model, file_path, time.time() - model_start_time, log_file)
+            return True
+        return False
+    except Exception as e:
+        log_migration_error(file_path, ', '.join(selected_model for selected_model, _ in entrants), e, log_file,
+                            duration=time.time() - model_start_time, prompt=prompt)
+        return False
+
+# Function to get the entrants for a file: every model at once when racing, or the primary then its backup when hedging
+def race_entrants(entrant_models):
+    if race_mode:
+        return [(selected_model, 0) for selected_model in entrant_models]
+
+    # Hedge delays are worked out when each file starts, from the latencies seen so far
+    primary_model = entrant_models[0]
+    return [(primary_model, 0)] + [(backup_model, hedge_delay(primary_model)) for backup_model in entrant_models[1:]]
+
+# Function to race a file, writing its log lines in one block and recording the result in the manifest
+# The caller holds the slot of the first entrant model.
+def migrate_code_racing_buffered(file_path, entrant_models, race_label, extraction_functions, log_file):
+    file_log = io.StringIO()
+
+    # Root span of the file's trace, like migrate_file for the other modes
+    with tracer.span('migrate_file', file=file_path, model=race_label) as attributes:
+        attributes['path'] = 'race'
+        result = migrate_code_racing(file_path, race_entrants(entrant_models), extraction_functions, file_log, held_model=entrant_models[0])
+        attributes['succeeded'] = result
+    record_manifest_entry(file_path, race_label, result)
+
+    with log_lock:
+        log_file.write(file_log.getvalue())
+        log_file.flush()
+
+    return result
+
+# Function to migrate all .java and .js files by racing race_models, or by hedging each model in models with its backup
+def migrate_files_racing(source_directories, models, extraction_functions, log_file):
+    if race_mode:
+        races = [('Race: ' + ', '.join(race_models), race_models)]
+    else:
+        races = []
+        for selected_model in models:
+            if selected_model in hedge_models:
+                races.append((f'Hedge: {selected_model} -> {hedge_models[selected_model]}', [selected_model, hedge_models[selected_model]]))
+            else:
+                races.append((selected_model, [selected_model]))
+
+    # A race starts once its first model has a free slot
+    jobs = []
+    for race_label, entrant_models in races:
+        log_file.write(f'Running {race_label}\n')
+        for source_directory in source_directories:
+            for file_path in pending_source_files(source_directory, race_label, log_file):
+                jobs.append((entrant_models[0], migrate_code_racing_buffered, (file_path, entrant_models, race_label, extraction_functions, log_file)))
+
+    run_limited_jobs(jobs, record_finished_job)
+
+# Function to estimate the token cost of migrating each file and build the scheduler jobs
+def build_scheduled_jobs(source_directories, models, log_file):
+    global skipped_files
+    prompt = build_prompt()
+    prompt_tokens = estimate_tokens(prompt)
+    output_ratio = output_token_ratios.get(target_language, 1.0)
+
+    jobs = []
+    for source_directory in source_directories:
+        for file_path in find_source_files(source_directory):
+            # With balanced models a file is done once any model has migrated it
+            if balance_models:
+                pending_models = [] if any(is_file_complete(file_path, selected_model, prompt) for selected_model in models) else [models]
+            else:
+                pending_models = [[selected_model] for selected_model in models if not is_file_complete(file_path, selected_model, prompt)]
+
+            with stats_lock:
+                skipped_files += (1 if balance_models else len(models)) - len(pending_models)
+            if not pending_models:
+                log_file.write(f'{datetime.now()}: Skipping unchanged {file_path}.\n')
+                continue
+
+            try:
+                with open(file_path, 'r', encoding='utf-8') as file:
+                    code_tokens = estimate_tokens(file.read())
+            except OSError:
+                code_tokens = 0
+
+            for candidate_models in pending_models:
+                jobs.append(MigrationJob(file_path, candidate_models, prompt_tokens + code_tokens, int(code_tokens * output_ratio)))
+
+    return jobs
+
+# Function to migrate a scheduled job and tell the scheduler its model is free again
+def migrate_scheduled_job(scheduler, job, selected_model, extraction_functions, log_file):
+    try:
+        return migrate_code_limited(job.file_path, selected_model, extraction_functions, log_file)
+    finally:
+        scheduler.finish(selected_model)
+
+# Function to migrate all .java and .js files largest first, packing each provider's token budget
+def migrate_files_scheduled(source_directories, models, extraction_functions, log_file):
+    jobs = build_scheduled_jobs(source_directories, models, log_file)
+    log_file.write(f'Scheduled {len(jobs)} jobs, estimated {sum(job.input_tokens for job in jobs)} input and '
+                   f'{sum(job.output_tokens for job in jobs)} output tokens\n')
+
+    scheduler = TokenBudgetScheduler(
+        jobs,
+        lambda selected_model: min(
+            model_concurrency_limits.get(selected_model, default_concurrency_limit),
+            provider_concurrency_limits.get(selected_model.split(' - ')[0], default_concurrency_limit)
+        ),
+        provider_token_budgets,
+        max_in_flight=max_workers
+    )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        while True:
+            scheduled = scheduler.next_job()
+            if scheduled is None:
+                break
+
+            job, selected_model = scheduled
+            with log_lock:
+                log_file.write(f'{datetime.now()}: Dispatching {job.file_path} to {selected_model} '
+                               f'(estimated {job.input_tokens} input, {job.output_tokens} output tokens).\n')
+            futures.append(executor.submit(migrate_scheduled_job, scheduler, job, selected_model, extraction_functions, log_file))
+
+        for future in as_completed(futures):
+            if future.result():
+                record_request()
+
+# Function to migrate all files in dependency order, starting each file once the files it depends on
+# have been migrated by the same model, so their migrated signatures can be sent as context
+def migrate_files_in_dependency_order(source_directories, models, extraction_functions, log_file):
+    global skipped_files
+    prompt = build_prompt()
+    levels = project_index.dependency_levels()
+    log_file.write(f'Indexed {sum(len(level) for level in levels)} files with {project_index.edge_count()} dependencies '
+                   f'in {len(levels)} levels\n')
+
+    jobs = []
+    for level in levels:
+        for file_path in level:
+            for selected_model in models:
+                if is_file_complete(file_path, selected_model, prompt):
+                    with stats_lock:
+                        skipped_files += 1
+                    log_file.write(f'{datetime.now()}: Skipping unchanged {file_path} for model {selected_model}.\n')
+
+                    # Use the signatures from the previous run's output
+                    try:
+                        with open(output_path_for(file_path), 'r', encoding='utf-8') as file:
+                            project_index.record_migrated(file_path, selected_model, file.read())
+                    except OSError:
+                        pass
+                    continue
+                jobs.append((file_path, selected_model))
+
+    # Each job waits for its dependencies in earlier levels that are migrated in this run
+    pending_jobs = set(jobs)
+    waiting = {}
+    dependents = {}
+    for job in jobs:
+        file_path, selected_model = job
+        waiting[job] = {(dependency, selected_model) for dependency in project_index.earlier_dependencies(file_path)
+                        if (dependency, selected_model) in pending_jobs}
+        for dependency_job in waiting[job]:
+            dependents.setdefault(dependency_job, []).append(job)
+
+    def limited_job(job):
+        file_path, selected_model = job
+        return selected_model, migrate_code_buffered, (file_path, selected_model, extraction_functions, log_file)
+
+    # Queue the files that were waiting for a finished one, even if it failed (they get its source signatures)
+    def on_finished(limited, result):
+        record_finished_job(limited, result)
+        file_path, selected_model = limited[2][:2]
+        finished_job = (file_path, selected_model)
+
+        ready_jobs = []
+        for job in dependents.get(finished_job, []):
+            waiting[job].discard(finished_job)
+            if not waiting[job]:
+                ready_jobs.append(limited_job(job))
+        return ready_jobs
+
+    run_limited_jobs([limited_job(job) for job in jobs if not waiting[job]], on_finished)
 
 # Main function to run the migration process
-def main():
-    global total_requests, model_times
+def main(force=False):
+    global total_requests, cache_hits, skipped_files, model_times, manifest, force_migration, verification_pipeline, results_store, run_id, project_index
     total_requests = 0
+    cache_hits = 0
+    skipped_files = 0
     model_times = {}
 
-    start_time = time.time()
+    force_migration = force
+    manifest = MigrationManifest(manifest_path)
+    results_store = ResultsStore(results_path)
+    try:
+        run_id = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if project_context_mode:
+            project_index = ProjectIndex([file_path for source_directory in source_directories for file_path in find_source_files(source_directory)])
 
-    # Log file for the entire script execution
-    log_filename = f'output/migration_logs/migration_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log'
-    with open(log_filename, 'w', encoding='utf-8') as log_file:
+        start_time = time.time()
 
-        # Migrate all files from each source directory
-        for selected_model in models:
-            log_file.write(f'Running model: {selected_model}\n')
-            for source_directory in source_directories:
-                migrate_files_from_directory(source_directory, selected_model, extraction_functions, log_file)
+        # Log file for the entire script execution
+        log_filename = f'output/migration_logs/migration_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log'
 
-        # Determine the file extension for tests
-        file_extension = language_extensions.get(target_language)
-        
-        # Run tests after all migrations are complete
-        if file_extension:
-            log_file.write('\nRunning tests...\n')
-            if run_tests(file_extension):
-                log_file.write('All tests passed successfully.\n')
+        # Start the verification stage before migrating so checks overlap with the remaining LLM requests
+        verification_filename = f'output/test_report/verification_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl'
+        if verification_mode:
+            verification_pipeline = VerificationPipeline(verification_commands, verification_filename, workers=verification_workers)
+
+        with open(log_filename, 'w', encoding='utf-8') as log_file:
+
+            # Migrate all files from each source directory
+            if race_mode or hedge_mode:
+                migrate_files_racing(source_directories, models, extraction_functions, log_file)
+            elif batch_mode:
+                migrate_files_in_batches(source_directories, models, extraction_functions, log_file)
+            elif scheduled_mode:
+                migrate_files_scheduled(source_directories, models, extraction_functions, log_file)
+            elif project_context_mode:
+                migrate_files_in_dependency_order(source_directories, models, extraction_functions, log_file)
+            elif concurrent_mode:
+                migrate_files_concurrently(source_directories, models, extraction_functions, log_file)
             else:
-                log_file.write('Some tests failed. Check the test results for details.\n')
+                for selected_model in models:
+                    log_file.write(f'Running model: {selected_model}\n')
+                    for source_directory in source_directories:
+                        migrate_files_from_directory(source_directory, selected_model, extraction_functions, log_file)
+
+            # Wait for the remaining per-file checks
+            if verification_pipeline is not None:
+                verification_summary = verification_pipeline.close()
+                verification_pipeline = None
+                log_file.write(f"\nPer-file checks: {verification_summary['passed']} passed, {verification_summary['failed']} failed. "
+                               f'Results saved to {verification_filename}.\n')
+
+            # Determine the file extension for tests
+            file_extension = language_extensions.get(target_language)
         
-        # Run SonarQube analysis
-        log_file.write('\nRunning SonarQube analysis...\n')
-        sonar_result = run_sonar_scanner()
-        log_file.write(sonar_result + '\n')
-
-        end_time = time.time()
-        total_time_minutes = (end_time - start_time) / 60.0
-
-        log_file.write('\nModel execution times:\n')
-        for model, execution_time in model_times.items():
-            if execution_time < 60:
-                log_file.write(f'{model}: {execution_time:.2f} seconds\n')
-            else:
-                log_file.write(f'{model}: {execution_time / 60:.2f} minutes\n')
+            # Run tests after all migrations are complete
+            if file_extension and run_final_tests:
+                log_file.write('\nRunning tests...\n')
+                with tracer.span('tests', file_extension=file_extension) as attributes:
+                    tests_passed = run_tests(file_extension)
+                    attributes['passed'] = tests_passed
+                if tests_passed:
+                    log_file.write('All tests passed successfully.\n')
+                else:
+                    log_file.write('Some tests failed. Check the test results for details.\n')
+        
+            # Run SonarQube analysis
+            if run_final_sonar:
+                log_file.write('\nRunning SonarQube analysis...\n')
+                with tracer.span('sonar'):
+                    sonar_result = run_sonar_scanner()
+                log_file.write(sonar_result + '\n')
+
+            end_time = time.time()
+            total_time_minutes = (end_time - start_time) / 60.0
+
+            log_file.write('\nModel execution times:\n')
+            for model, execution_time in model_times.items():
+                if execution_time < 60:
+                    log_file.write(f'{model}: {execution_time:.2f} seconds\n')
+                else:
+                    log_file.write(f'{model}: {execution_time / 60:.2f} minutes\n')
 
-        log_file.write(f'Total number of requests processed: {total_requests}\n')
-        log_file.write(f'Total execution time: {total_time_minutes:.2f} minutes\n')
+            log_file.write(f'Total number of requests processed: {total_requests}\n')
+            log_file.write(f'Total number of cached responses: {cache_hits}\n')
+            log_file.write(f'Total number of unchanged files skipped: {skipped_files}\n')
+            log_file.write(f'Total execution time: {total_time_minutes:.2f} minutes\n')
+            log_file.write(f'Results for run {run_id} saved to {results_path}\n')
+    finally:
+        # Flush the buffered results and close the stores even when the run is interrupted
+        manifest.close()
+        results_store.close()
+        results_store = None
+        project_index = None
+        tracer.close()
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Migrate source files through the code migration API.')
+    parser.add_argument('--force', action='store_true', help='migrate every file, ignoring the manifest of previous runs')
+    args = parser.parse_args()
+    main(force=args.force)
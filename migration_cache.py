@@ -0,0 +1,221 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Function to build the cache key from the model name, prompt and source code
+def cache_key(model_name, prompt, code):
+    key_data = json.dumps([model_name, prompt, code], ensure_ascii=False)
+    return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+# In-memory LRU tier with a maximum number of entries and a time-to-live
+class MemoryCache:
+    def __init__(self, max_entries=256, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            stored_at, value = entry
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                del self.entries[key]
+                return None
+
+            # Mark the entry as most recently used
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+
+            # Evict the least recently used entries
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+# On-disk tier storing one JSON file per key, evicted by total size and time-to-live.
+# A file's modification time is when it was stored (for the time-to-live) and its access time is when it was last used
+# (for LRU eviction). The total size is tracked as entries are written, so the directory is only scanned when the cache
+# is over its limit, or once per sweep interval to drop expired entries.
+class DiskCache:
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, ttl_seconds=7 * 24 * 3600, sweep_interval_seconds=3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.evict()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        path = self.path_for(key)
+        try:
+            stored_at = os.path.getmtime(path)
+            if self.ttl_seconds and time.time() - stored_at > self.ttl_seconds:
+                self.remove(path)
+                return None
+
+            with open(path, 'r', encoding='utf-8') as cache_file:
+                value = json.load(cache_file)
+
+            # Record the use in the access time only, keeping the stored time for the time-to-live
+            os.utime(path, (time.time(), stored_at))
+            return value
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        path = self.path_for(key)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump(value, cache_file)
+        size = os.path.getsize(temp_path)
+
+        with self.lock:
+            try:
+                self.total_bytes -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(temp_path, path)
+            self.total_bytes += size
+            needs_eviction = (self.total_bytes > self.max_bytes
+                              or time.time() - self.last_sweep_time > self.sweep_interval_seconds)
+
+        if needs_eviction:
+            self.evict()
+
+    def remove(self, path):
+        with self.lock:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                self.total_bytes -= size
+            except OSError:
+                pass
+
+    # Scan the directory, dropping expired entries and then the least recently used ones until the cache is
+    # under 90% of its limit, so the next writes do not trigger another scan straight away
+    def evict(self):
+        with self.lock:
+            entries = []
+            total_bytes = 0
+            now = time.time()
+            for file_name in os.listdir(self.directory):
+                if not file_name.endswith('.json'):
+                    continue
+                path = os.path.join(self.directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                if self.ttl_seconds and now - stat.st_mtime > self.ttl_seconds:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+
+                entries.append((stat.st_atime, stat.st_size, path))
+                total_bytes += stat.st_size
+
+            entries.sort()
+            while entries and total_bytes > self.max_bytes * 0.9:
+                _, size, path = entries.pop(0)
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total_bytes -= size
+
+            self.total_bytes = total_bytes
+            self.last_sweep_time = now
+
+# Two-tier cache that also makes identical concurrent requests share one LLM call
+class MigrationCache:
+    def __init__(self, memory_cache, disk_cache=None):
+        self.memory_cache = memory_cache
+        self.disk_cache = disk_cache
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+        self.stats = {'hits': 0, 'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'coalesced': 0}
+        self.stats_lock = threading.Lock()
+
+    def count(self, *names):
+        with self.stats_lock:
+            for name in names:
+                self.stats[name] += 1
+
+    def lookup(self, key):
+        value = self.memory_cache.get(key)
+        if value is not None:
+            self.count('hits', 'memory_hits')
+            return value
+
+        if self.disk_cache is not None:
+            value = self.disk_cache.get(key)
+            if value is not None:
+                # Promote disk hits to the memory tier
+                self.memory_cache.set(key, value)
+                self.count('hits', 'disk_hits')
+                return value
+
+        return None
+
+    def store(self, key, value):
+        self.memory_cache.set(key, value)
+        if self.disk_cache is not None:
+            self.disk_cache.set(key, value)
+
+    # Return (value, cache_hit), calling compute() only if no cached or in-flight result exists
+    def get_or_compute(self, key, compute):
+        value = self.lookup(key)
+        if value is not None:
+            return value, True
+
+        with self.in_flight_lock:
+            pending = self.in_flight.get(key)
+            if pending is None:
+                pending = {'event': threading.Event(), 'value': None, 'error': None}
+                self.in_flight[key] = pending
+                is_leader = True
+            else:
+                is_leader = False
+
+        if not is_leader:
+            # Wait for the request already in flight instead of calling the LLM again
+            pending['event'].wait()
+            if pending['error'] is not None:
+                raise pending['error']
+            self.count('hits', 'coalesced')
+            return pending['value'], True
+
+        self.count('misses')
+        try:
+            value = compute()
+            self.store(key, value)
+            pending['value'] = value
+            return value, False
+        except Exception as e:
+            pending['error'] = e
+            raise
+        finally:
+            with self.in_flight_lock:
+                del self.in_flight[key]
+            pending['event'].set()
+
+    def get_stats(self):
+        with self.stats_lock:
+            return dict(self.stats)
@@ -0,0 +1,85 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+
+# Function to hash the contents of a source file
+def file_hash(file_path):
+    with open(file_path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+# Function to hash a prompt so manifest keys stay short
+def prompt_hash(prompt):
+    return hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]
+
+# Persistent record of every (model, prompt, source file) migration, stored as append-only JSON lines
+class MigrationManifest:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.load()
+
+        # Rewrite the file with only the latest entry for each key, then keep appending to it
+        self.compact()
+        self.manifest_file = open(path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def entry_key(selected_model, prompt, file_path):
+        return f'{selected_model}|{prompt_hash(prompt)}|{os.path.abspath(file_path)}'
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'r', encoding='utf-8') as manifest_file:
+            for line in manifest_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Skip a line left half-written by a killed run
+                    continue
+                self.entries[entry['key']] = entry
+
+    def compact(self):
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as manifest_file:
+            for entry in self.entries.values():
+                manifest_file.write(json.dumps(entry) + '\n')
+        os.replace(temp_path, self.path)
+
+    # Check whether the file was already migrated successfully from the same source contents
+    def is_complete(self, selected_model, prompt, file_path, source_hash):
+        entry = self.entries.get(self.entry_key(selected_model, prompt, file_path))
+        if entry is None or entry['status'] != 'succeeded' or entry['source_hash'] != source_hash:
+            return False
+        return entry.get('output_path') is None or os.path.exists(entry['output_path'])
+
+    def record(self, selected_model, prompt, file_path, source_hash, status, output_path=None):
+        entry = {
+            'key': self.entry_key(selected_model, prompt, file_path),
+            'model': selected_model,
+            'prompt_hash': prompt_hash(prompt),
+            'source_path': file_path,
+            'source_hash': source_hash,
+            'output_path': output_path,
+            'status': status,
+            'updated_at': datetime.now().isoformat()
+        }
+
+        with self.lock:
+            self.entries[entry['key']] = entry
+
+            # Flush each entry so a killed run can resume from the last finished file
+            self.manifest_file.write(json.dumps(entry) + '\n')
+            self.manifest_file.flush()
+
+    def close(self):
+        with self.lock:
+            self.manifest_file.close()
@@ -0,0 +1,98 @@
+import time
+import threading
+from collections import deque
+
+# Expected output tokens per input token for each target language
+output_token_ratios = {
+    'kotlin': 0.85,
+    'typescript': 1.1,
+}
+
+# One file to migrate with any of its candidate models, with its estimated token cost
+class MigrationJob:
+    def __init__(self, file_path, models, input_tokens, output_tokens):
+        self.file_path = file_path
+        self.models = models
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+
+    @property
+    def total_tokens(self):
+        return self.input_tokens + self.output_tokens
+
+# Scheduler handing out the most expensive jobs first, to whichever candidate model has spare capacity,
+# without going over each provider's tokens-per-minute budget
+class TokenBudgetScheduler:
+    def __init__(self, jobs, model_limits, provider_token_budgets, max_in_flight, window_seconds=60.0):
+        # Longest jobs first, so a few huge files do not finish last
+        self.jobs = sorted(jobs, key=lambda job: job.total_tokens, reverse=True)
+        self.model_limits = model_limits
+        self.provider_token_budgets = provider_token_budgets
+        self.max_in_flight = max_in_flight
+        self.window_seconds = window_seconds
+        self.in_flight = {}
+        self.provider_usage = {}
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def provider_of(selected_model):
+        return selected_model.split(' - ')[0]
+
+    # Tokens sent to a provider within the last window, dropping older entries
+    def window_usage(self, provider, now):
+        usage = self.provider_usage.setdefault(provider, deque())
+        while usage and now - usage[0][0] > self.window_seconds:
+            usage.popleft()
+        return sum(tokens for _, tokens in usage)
+
+    def fits_budget(self, provider, tokens, now):
+        budget = self.provider_token_budgets.get(provider, 0)
+        if not budget:
+            return True
+
+        used = self.window_usage(provider, now)
+        # A job bigger than the whole budget is sent on its own once the window is empty
+        return used + tokens <= budget or used == 0
+
+    # Seconds until the oldest budgeted request leaves the window
+    def time_until_budget_frees(self, now):
+        oldest = [usage[0][0] for usage in self.provider_usage.values() if usage]
+        if not oldest:
+            return 1.0
+        return max(0.05, min(oldest) + self.window_seconds - now)
+
+    def choose(self, now):
+        if sum(self.in_flight.values()) >= self.max_in_flight:
+            return None
+
+        for job in self.jobs:
+            # Prefer the least loaded candidate model
+            candidates = sorted(job.models, key=lambda selected_model: self.in_flight.get(selected_model, 0) / self.model_limits(selected_model))
+            for selected_model in candidates:
+                if self.in_flight.get(selected_model, 0) >= self.model_limits(selected_model):
+                    continue
+                if not self.fits_budget(self.provider_of(selected_model), job.total_tokens, now):
+                    continue
+                return job, selected_model
+        return None
+
+    # Block until a job can be dispatched and return (job, model), or None when every job has been handed out
+    def next_job(self):
+        with self.condition:
+            while self.jobs:
+                now = time.monotonic()
+                choice = self.choose(now)
+                if choice is not None:
+                    job, selected_model = choice
+                    self.jobs.remove(job)
+                    self.in_flight[selected_model] = self.in_flight.get(selected_model, 0) + 1
+                    self.provider_usage.setdefault(self.provider_of(selected_model), deque()).append((now, job.total_tokens))
+                    return job, selected_model
+
+                self.condition.wait(timeout=self.time_until_budget_frees(now))
+            return None
+
+    def finish(self, selected_model):
+        with self.condition:
+            self.in_flight[selected_model] -= 1
+            self.condition.notify_all()
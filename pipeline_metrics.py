@@ -0,0 +1,130 @@
+import math
+import threading
+
+# Default histogram buckets in seconds, from fast cache hits up to slow model calls
+default_buckets = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Function to format a sample value for the Prometheus text format
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+# Function to format a label set, escaping the characters the text format reserves
+def format_labels(label_names, label_values):
+    if not label_names:
+        return ''
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+# Base class for a metric family with a fixed list of label names
+class Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def label_values(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        return [f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}' for key, value in sorted(values.items())]
+
+    def render(self):
+        return self.header() + self.samples()
+
+class Counter(Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    metric_type = 'gauge'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.label_values(labels)] = value
+
+class Histogram(Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=default_buckets):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            # Per label set: a count per bucket, the sum and the total count
+            counts, total = self.values.get(key, ([0] * len(self.buckets), [0.0, 0]))
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    counts[index] += 1
+            total[0] += value
+            total[1] += 1
+            self.values[key] = (counts, total)
+
+    def samples(self):
+        with self.lock:
+            values = {key: (list(counts), list(total)) for key, (counts, total) in self.values.items()}
+
+        lines = []
+        for key, (counts, total) in sorted(values.items()):
+            for upper_bound, count in zip(self.buckets, counts):
+                labels = format_labels(self.label_names + ('le',), key + (format_value(upper_bound),))
+                lines.append(f'{self.name}_bucket{labels} {format_value(count)}')
+            labels = format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {format_value(total[0])}')
+            lines.append(f'{self.name}_count{labels} {format_value(total[1])}')
+        return lines
+
+# Metric whose values are read from a function when the metrics are scraped, e.g. counters kept elsewhere
+class CallbackMetric(Metric):
+    def __init__(self, name, documentation, metric_type, label_names, callback):
+        super().__init__(name, documentation, label_names)
+        self.metric_type = metric_type
+        self.callback = callback
+
+    def samples(self):
+        values = self.callback()
+        return [f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}' for key, value in sorted(values.items())]
+
+# Collection of metric families rendered together for a /metrics endpoint
+class MetricsRegistry:
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# Tracer writing one JSON object per line for each timed pipeline stage (span).
+# Spans opened inside another span on the same thread share its trace id and record it as their parent.
+class Tracer:
+    def __init__(self, path, service):
+        self.path = path
+        self.service = service
+        self.file = None
+        self.file_lock = threading.Lock()
+        self.local = threading.local()
+        self.listeners = []
+
+    # Register a function called with every finished span, e.g. to update metrics
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def current_span(self):
+        stack = getattr(self.local, 'stack', None)
+        return stack[-1] if stack else None
+
+    def current_trace_id(self):
+        span = self.current_span()
+        return span['trace_id'] if span else None
+
+    # Time the body of a with block, yielding the span attributes so the body can add to them
+    @contextmanager
+    def span(self, name, trace_id=None, **attributes):
+        stack = self.local.__dict__.setdefault('stack', [])
+        parent = stack[-1] if stack else None
+
+        span = {
+            'trace_id': trace_id or (parent['trace_id'] if parent else uuid.uuid4().hex),
+            'span_id': uuid.uuid4().hex[:16],
+            'parent_id': parent['span_id'] if parent else None,
+            'service': self.service,
+            'name': name,
+            'start': datetime.now().isoformat(),
+            'duration': None,
+            'status': 'ok',
+            'attributes': attributes
+        }
+        stack.append(span)
+        start_time = time.perf_counter()
+
+        try:
+            yield attributes
+        except Exception as e:
+            span['status'] = 'error'
+            span['error'] = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            span['duration'] = time.perf_counter() - start_time
+            stack.remove(span)
+            self.finish(span)
+
+    def finish(self, span):
+        for listener in self.listeners:
+            listener(span)
+
+        if not self.path:
+            return
+
+        line = json.dumps(span, default=str) + '\n'
+        with self.file_lock:
+            if self.file is None:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.file_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
@@ -0,0 +1,353 @@
+import os
+import re
+import threading
+from source_chunker import statement_boundaries, split_at, header_statement
+
+# Comments and annotations left out of signatures
+comments_and_annotations = re.compile(r'/\*[\s\S]*?\*/|//[^\n]*|@[\w.]+(?:\([^()]*\))?')
+
+# Comments and string literals, removed before looking for the type names a file uses
+comments_and_literals = re.compile(r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`|//[^\n]*|/\*[\s\S]*?\*/')
+
+# Top-level statements kept as signatures: classes, functions and constants (Java, JavaScript, Kotlin or TypeScript)
+top_level_declaration = re.compile(
+    r'(?:export\s+)?(?:default\s+)?'
+    r'(?:(?:public|protected|internal|abstract|final|open|data|sealed|static|async|inline|suspend|declare)\s+)*'
+    r'(?:class|interface|enum|record|object|function\*?|fun|const|let|var|val|type)\b'
+)
+
+# Declarations whose body is listed member by member
+type_declaration = re.compile(r'\b(?:class|interface|enum|record|object)\b')
+
+# Members left out of signatures: private members, initialiser blocks and stray statements
+hidden_member = re.compile(r'(?:private\b|#|(?:static|init)\s*$|(?:if|for|while|switch|try|do|else|return|throw)\b)')
+
+# Start of a line declaring a member in Kotlin or TypeScript, where statements need not end with a semicolon
+member_start = re.compile(
+    r'[ \t]*(?:@\w+\s+)*'
+    r'(?:(?:public|protected|internal|private|override|open|abstract|final|suspend|inline|operator|infix|lateinit|'
+    r'const|static|readonly|async|data|sealed|enum|inner)\s+)*'
+    r'(?:fun|val|var|class|interface|object|companion|init|constructor)\b'
+)
+
+declared_name = re.compile(r'\b(?:class|interface|enum|record|object|function\*?|fun|const|let|var|val|type)\s+(?:<[^>]*>\s*)?([\w$]+)')
+
+java_package = re.compile(r'^\s*package\s+([\w.]+)\s*;', re.M)
+java_import = re.compile(r'^\s*import\s+(static\s+)?([\w.]+?)(\.\*)?\s*;', re.M)
+java_type_name = re.compile(r'\b(?:class|interface|enum|record)\s+(\w+)')
+
+# require('./x') and import ... from './x', with the names taken from the module when they are listed
+javascript_require = re.compile(r'(?:(?:const|let|var)\s+(\{[^}]*\}|[\w$]+)\s*=\s*)?require\(\s*[\'"]([^\'"]+)[\'"]\s*\)')
+javascript_import = re.compile(r'\bimport\s+(?:([\w$]+)\s*,?\s*)?(\{[^}]*\}|\*\s*as\s+[\w$]+)?\s*(?:from\s+)?[\'"]([^\'"]+)[\'"]')
+javascript_exports = re.compile(
+    r'module\.exports\s*=\s*(\{[^}]*\}|[\w$]+)|(?:module\.)?exports\.([\w$]+)\s*=|'
+    r'\bexport\s+(?:default\s+)?(?:async\s+)?(?:function\*?|class|const|let|var)\s+([\w$]+)|\bexport\s*(\{[^}]*\})'
+)
+
+# Function to get the names listed in a destructuring or export list such as { a, b: c }
+def listed_names(names_text):
+    names = set()
+    for name in names_text.strip('{} \n').split(','):
+        name = name.split(':')[0].split(' as ')[0].strip()
+        if name:
+            names.add(name)
+    return names
+
+# Function to split code into top-level statements or class members, also splitting
+# consecutive Kotlin declarations that have no semicolons between them
+def split_members(code):
+    members = []
+    for statement in split_at(code, statement_boundaries(code)):
+        # Blank out comments and literals (keeping their length) so brackets inside them are not counted
+        masked = comments_and_literals.sub(lambda match: re.sub(r'[^\n]', ' ', match.group()), statement)
+        start = 0
+        position = 0
+        depth = 0
+        for line in masked.splitlines(keepends=True):
+            if depth == 0 and position > start and member_start.match(line) and statement[start:position].strip():
+                members.append(statement[start:position])
+                start = position
+            depth += line.count('{') + line.count('(') - line.count('}') - line.count(')')
+            position += len(line)
+        if statement[start:].strip():
+            members.append(statement[start:])
+    return members
+
+# Function to split a statement into the text before its first block and the block's body (None if it has no block)
+def split_block(statement):
+    statement = comments_and_annotations.sub(' ', statement)
+    paren_depth = 0
+    for index, char in enumerate(statement):
+        if char in '([':
+            paren_depth += 1
+        elif char in ')]':
+            paren_depth = max(0, paren_depth - 1)
+        elif char == '{' and paren_depth == 0:
+            body_end = statement.rfind('}')
+            body = statement[index + 1:body_end] if body_end > index else ''
+            return statement[:index].strip(), body
+    return statement.strip().rstrip(';,').strip(), None
+
+# Function to collapse a declaration onto one short line
+def compact(text, max_chars=200):
+    text = ' '.join(text.split()).rstrip(';,=').strip()
+    return text if len(text) <= max_chars else text[:max_chars - 3] + '...'
+
+# Function to list a declaration and, for classes, its visible members without their bodies
+def declaration_lines(header, body, indent=''):
+    if body is None:
+        # Consecutive properties without semicolons end up in one statement, keep one per line
+        return [indent + compact(line) for line in header.splitlines() if compact(line)]
+
+    if not type_declaration.search(header):
+        return [indent + compact(header)]
+
+    lines = [f'{indent}{compact(header)} {{']
+    for member in split_members(body):
+        member_header, member_body = split_block(member)
+        if not member_header or hidden_member.match(member_header):
+            continue
+        lines.extend(declaration_lines(member_header, member_body, indent + '    '))
+    lines.append(f'{indent}}}')
+    return lines
+
+# Function to extract the signatures of a file's top-level declarations, as a list of {'name', 'lines'} entries
+def extract_signatures(code):
+    entries = []
+    for statement in split_members(code):
+        if header_statement.match(comments_and_annotations.sub(' ', statement)):
+            continue
+
+        header, body = split_block(statement)
+        if not top_level_declaration.match(header):
+            continue
+
+        name_match = declared_name.search(header)
+        entries.append({
+            'name': name_match.group(1) if name_match else None,
+            'lines': declaration_lines(header, body)
+        })
+    return entries
+
+# Symbol index of a project: the types, exports and imports of every file, and the dependencies between files.
+# Also keeps the signatures of files already migrated by each model, so later files can be given them as context.
+class ProjectIndex:
+    def __init__(self, file_paths):
+        self.files = {}
+        self.java_types = {}
+        self.migrated = {}
+        self.lock = threading.Lock()
+
+        for file_path in file_paths:
+            self.add_file(file_path)
+
+        # Dependency file -> names used from it (None when the whole module is used)
+        self.dependencies = {key: self.find_dependencies(key) for key in self.files}
+        self.levels = self.find_levels()
+
+    @staticmethod
+    def key_for(file_path):
+        return os.path.normpath(os.path.abspath(file_path))
+
+    def add_file(self, file_path):
+        try:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                code = file.read()
+        except (OSError, UnicodeDecodeError):
+            return
+
+        key = self.key_for(file_path)
+        plain_code = comments_and_literals.sub(' ', code)
+        info = {
+            'path': file_path,
+            'language': 'java' if file_path.endswith('.java') else 'javascript',
+            'entries': extract_signatures(code),
+            'words': set(re.findall(r'[\w$]+', plain_code)),
+            'imports': [],
+            'exports': set()
+        }
+
+        if info['language'] == 'java':
+            package_match = java_package.search(code)
+            info['package'] = package_match.group(1) if package_match else ''
+            for static, name, wildcard in java_import.findall(code):
+                # A static import names a member, the type is the part before it
+                if static and not wildcard:
+                    name = name.rsplit('.', 1)[0]
+                info['imports'].append((name, bool(wildcard)))
+
+            for type_name in java_type_name.findall(plain_code):
+                qualified_name = f"{info['package']}.{type_name}" if info['package'] else type_name
+                self.java_types.setdefault(qualified_name, key)
+        else:
+            for names_text, specifier in javascript_require.findall(code):
+                info['imports'].append((specifier, listed_names(names_text) if names_text.startswith('{') else None))
+            for default_name, names_text, specifier in javascript_import.findall(code):
+                info['imports'].append((specifier, listed_names(names_text) if names_text.startswith('{') and not default_name else None))
+
+            for module_exports, named_export, declared_export, export_list in javascript_exports.findall(code):
+                if module_exports.startswith('{') or export_list:
+                    info['exports'] |= listed_names(module_exports or export_list)
+                elif module_exports or named_export or declared_export:
+                    info['exports'].add(module_exports or named_export or declared_export)
+
+        self.files[key] = info
+
+    # Function to resolve a relative JavaScript module specifier to an indexed file
+    def resolve_module(self, importer_key, specifier):
+        if not specifier.startswith('.'):
+            return None
+        base = os.path.normpath(os.path.join(os.path.dirname(importer_key), specifier))
+        for candidate in (base, base + '.js', base + '.mjs', base + '.cjs', os.path.join(base, 'index.js')):
+            if candidate in self.files:
+                return candidate
+        return None
+
+    def find_dependencies(self, key):
+        info = self.files[key]
+        dependencies = {}
+
+        if info['language'] == 'java':
+            imported = {name for name, wildcard in info['imports'] if not wildcard}
+            wildcard_packages = {name for name, wildcard in info['imports'] if wildcard}
+
+            for qualified_name, dependency_key in self.java_types.items():
+                package, _, type_name = qualified_name.rpartition('.')
+                if dependency_key == key or type_name not in info['words']:
+                    continue
+                # Types are visible from the same package, an import of the type or of its enclosing type, or a wildcard import
+                if (package == info['package'] or qualified_name in imported or package in wildcard_packages
+                        or any(qualified_name.startswith(name + '.') for name in imported)):
+                    dependencies.setdefault(dependency_key, set()).add(type_name)
+        else:
+            for specifier, names in info['imports']:
+                dependency_key = self.resolve_module(key, specifier)
+                if dependency_key is None or dependency_key == key:
+                    continue
+                if names is None or dependencies.get(dependency_key, set()) is None:
+                    dependencies[dependency_key] = None
+                else:
+                    dependencies.setdefault(dependency_key, set()).update(names)
+
+        return dependencies
+
+    # Group the files into levels where every file only depends on files in earlier levels.
+    # The files of an import cycle (a strongly connected component) share a level, placed after everything the cycle depends on.
+    def find_levels(self):
+        component_levels = []
+        level_of = {}
+
+        for component in self.find_cycles():
+            members = set(component)
+            outside_dependencies = {dependency for key in component for dependency in self.dependencies[key]
+                                    if dependency in self.files and dependency not in members}
+            # Components come out dependencies first, so every outside dependency already has a level
+            level_number = 1 + max((level_of[dependency] for dependency in outside_dependencies), default=-1)
+            for key in component:
+                level_of[key] = level_number
+
+            while len(component_levels) <= level_number:
+                component_levels.append([])
+            component_levels[level_number].extend(component)
+
+        return [sorted(level) for level in component_levels]
+
+    # Find the strongly connected components of the dependency graph (Tarjan's algorithm, without recursion so
+    # long import chains do not hit the recursion limit). A component is returned after the components it depends on.
+    def find_cycles(self):
+        index_of = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        for root in sorted(self.files):
+            if root in index_of:
+                continue
+
+            # Each frame is a file and the iterator over its remaining dependencies
+            frames = [(root, iter(sorted(self.dependencies[root])))]
+            index_of[root] = lowlink[root] = len(index_of)
+            stack.append(root)
+            on_stack.add(root)
+
+            while frames:
+                key, dependencies = frames[-1]
+                dependency = next((dependency for dependency in dependencies if dependency in self.files), None)
+
+                if dependency is not None:
+                    if dependency not in index_of:
+                        index_of[dependency] = lowlink[dependency] = len(index_of)
+                        stack.append(dependency)
+                        on_stack.add(dependency)
+                        frames.append((dependency, iter(sorted(self.dependencies[dependency]))))
+                    elif dependency in on_stack:
+                        lowlink[key] = min(lowlink[key], index_of[dependency])
+                    continue
+
+                frames.pop()
+                if frames:
+                    parent = frames[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[key])
+
+                if lowlink[key] == index_of[key]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == key:
+                            break
+                    components.append(component)
+
+        return components
+
+    # Return the file paths level by level, in dependency order
+    def dependency_levels(self):
+        return [[self.files[key]['path'] for key in level] for level in self.levels]
+
+    # Return the dependencies of a file that are in earlier levels (and so can be migrated first)
+    def earlier_dependencies(self, file_path):
+        key = self.key_for(file_path)
+        level_number = next((number for number, level in enumerate(self.levels) if key in level), 0)
+        earlier = set().union(*self.levels[:level_number]) if level_number else set()
+        return [self.files[dependency]['path'] for dependency in sorted(self.dependencies.get(key, {})) if dependency in earlier]
+
+    def edge_count(self):
+        return sum(len(dependencies) for dependencies in self.dependencies.values())
+
+    # Keep the signatures of a file migrated by a model, to give to the files that depend on it
+    def record_migrated(self, file_path, selected_model, migrated_code):
+        entries = extract_signatures(migrated_code)
+        with self.lock:
+            self.migrated[(selected_model, self.key_for(file_path))] = entries
+
+    # Return the signatures of the declarations a file uses from other files, migrated ones where available
+    def context_for(self, file_path, selected_model, max_chars):
+        key = self.key_for(file_path)
+        sections = []
+        used_chars = 0
+
+        for dependency_key, names in sorted(self.dependencies.get(key, {}).items()):
+            dependency = self.files[dependency_key]
+            with self.lock:
+                entries = self.migrated.get((selected_model, dependency_key))
+            migrated = entries is not None
+            if entries is None:
+                entries = dependency['entries']
+
+            # Only the declarations the file uses, or the module's exports when it uses the whole module
+            wanted = names if names is not None else (dependency['exports'] or None)
+            selected_entries = [entry for entry in entries if wanted is None or entry['name'] in wanted] or entries
+
+            signatures = '\n'.join(line for entry in selected_entries for line in entry['lines'])
+            if not signatures:
+                continue
+
+            section = f"// {dependency['path']}{'' if migrated else ' (not migrated yet)'}\n{signatures}"
+            if used_chars + len(section) > max_chars:
+                break
+            sections.append(section)
+            used_chars += len(section)
+
+        return '\n\n'.join(sections)
@@ -0,0 +1,99 @@
+import re
+import math
+import time
+import asyncio
+import threading
+
+# Pieces a BPE tokenizer usually splits code into: words (split at camelCase), numbers, newlines and symbols
+token_pieces = re.compile(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+|\n|[^\w\s]')
+
+# Raised when a request cannot fit within the rate limit before the maximum wait
+class RateLimitExceeded(Exception):
+    def __init__(self, provider, retry_after):
+        super().__init__(f'Rate limit exceeded for {provider}, retry after {retry_after:.1f} seconds')
+        self.provider = provider
+        self.retry_after = retry_after
+
+# Token bucket refilled continuously up to its per-minute capacity
+class TokenBucket:
+    def __init__(self, capacity_per_minute):
+        self.capacity = capacity_per_minute
+        self.available = float(capacity_per_minute)
+        self.rate_per_second = capacity_per_minute / 60.0
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    # Seconds until the bucket holds the given amount
+    def wait_time(self, amount):
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.rate_per_second
+
+# Requests-per-minute and tokens-per-minute budgets for one provider.
+# Callers wait for budget instead of failing, which keeps throughput steady rather than bursting into rate-limit errors.
+class RateLimiter:
+    def __init__(self, provider, requests_per_minute=0, tokens_per_minute=0):
+        self.provider = provider
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.lock = threading.Lock()
+
+    # Take the budget if it is available now, otherwise return how many seconds to wait
+    def try_acquire(self, tokens, requests=1):
+        with self.lock:
+            now = time.monotonic()
+            buckets = []
+            if self.request_bucket is not None:
+                # A single call larger than the whole budget is allowed once the bucket is full
+                buckets.append((self.request_bucket, min(requests, self.request_bucket.capacity)))
+            if self.token_bucket is not None:
+                buckets.append((self.token_bucket, min(tokens, self.token_bucket.capacity)))
+
+            for bucket, amount in buckets:
+                bucket.refill(now)
+            wait = max([bucket.wait_time(amount) for bucket, amount in buckets], default=0.0)
+
+            if wait == 0.0:
+                for bucket, amount in buckets:
+                    bucket.available -= amount
+            return wait
+
+    def acquire(self, tokens, requests=1, max_wait=30.0):
+        deadline = time.monotonic() + max_wait
+
+        while True:
+            wait = self.try_acquire(tokens, requests)
+            if wait == 0.0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(self.provider, wait)
+            time.sleep(wait)
+
+    # Same as acquire, but waits without blocking the event loop
+    async def acquire_async(self, tokens, requests=1, max_wait=30.0):
+        deadline = time.monotonic() + max_wait
+
+        while True:
+            wait = self.try_acquire(tokens, requests)
+            if wait == 0.0:
+                return
+            if time.monotonic() + wait > deadline:
+                raise RateLimitExceeded(self.provider, wait)
+            await asyncio.sleep(wait)
+
+# Function to estimate the number of tokens in some text without calling a tokenizer service.
+# The client's scheduler and the API's rate limits both use this, so their token budgets agree.
+def estimate_tokens(text):
+    tokens = 0
+    for piece in token_pieces.findall(text or ''):
+        if piece[0].isalpha():
+            # Long words are split into several tokens
+            tokens += max(1, math.ceil(len(piece) / 6))
+        elif piece[0].isdigit():
+            tokens += math.ceil(len(piece) / 3)
+        else:
+            tokens += 1
+    return tokens
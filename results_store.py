@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime
+
+# Columns stored for every migration result
+result_columns = (
+    'run_id', 'recorded_at', 'model', 'prompt_hash', 'source_path', 'output_path',
+    'extraction', 'succeeded', 'cache_hit', 'duration', 'error', 'response'
+)
+
+# Single SQLite database holding the result of every migration, instead of one JSON file per source file.
+# Rows are buffered and inserted in batches, so recording a result does not wait on the disk.
+class ResultsStore:
+    def __init__(self, path, batch_size=50, flush_interval=5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.last_flush_time = time.monotonic()
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        # Let queries from other processes read while a run is writing
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                run_id TEXT,
+                recorded_at TEXT,
+                model TEXT,
+                prompt_hash TEXT,
+                source_path TEXT,
+                output_path TEXT,
+                extraction TEXT,
+                succeeded INTEGER,
+                cache_hit INTEGER,
+                duration REAL,
+                error TEXT,
+                response TEXT
+            )
+        ''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_source ON results (source_path, model)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS results_run ON results (run_id, model)')
+        self.connection.commit()
+
+    # Buffer one result; extraction is 'extracted', 'empty' (no code found in the response) or 'error'
+    def record(self, run_id, selected_model, prompt_hash, source_path, extraction, output_path=None,
+               cache_hit=False, duration=None, error=None, response_json=None):
+        row = (
+            run_id,
+            datetime.now().isoformat(),
+            selected_model,
+            prompt_hash,
+            source_path,
+            output_path,
+            extraction,
+            int(extraction == 'extracted'),
+            int(bool(cache_hit)),
+            duration,
+            error,
+            json.dumps(response_json) if response_json is not None else None
+        )
+
+        with self.lock:
+            self.pending.append(row)
+            if len(self.pending) >= self.batch_size or time.monotonic() - self.last_flush_time >= self.flush_interval:
+                self.flush_pending()
+
+    def flush_pending(self):
+        if self.pending:
+            with self.connection:
+                self.connection.executemany(
+                    f'INSERT INTO results ({", ".join(result_columns)}) VALUES ({", ".join("?" * len(result_columns))})',
+                    self.pending
+                )
+            self.pending = []
+        self.last_flush_time = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self.flush_pending()
+
+    # Return the matching results, newest first, without the stored responses unless asked for
+    def query(self, run_id=None, selected_model=None, source_path=None, succeeded=None, limit=None, include_response=False):
+        conditions = []
+        parameters = []
+        for column, value in (('run_id', run_id), ('model', selected_model), ('source_path', source_path)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                parameters.append(value)
+        if succeeded is not None:
+            conditions.append('succeeded = ?')
+            parameters.append(int(succeeded))
+
+        columns = ['id'] + [column for column in result_columns if include_response or column != 'response']
+        sql = f'SELECT {", ".join(columns)} FROM results'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY id DESC'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            parameters.append(limit)
+
+        with self.lock:
+            self.flush_pending()
+            rows = self.connection.execute(sql, parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    # Return the number of files, successes, cache hits and the average time per model
+    def summary(self, run_id=None):
+        sql = '''
+            SELECT model, COUNT(*) AS files, SUM(succeeded) AS succeeded, SUM(cache_hit) AS cache_hits,
+                   AVG(duration) AS average_duration, SUM(duration) AS total_duration
+            FROM results
+        '''
+        parameters = []
+        if run_id is not None:
+            sql += ' WHERE run_id = ?'
+            parameters.append(run_id)
+        sql += ' GROUP BY model ORDER BY model'
+
+        with self.lock:
+            self.flush_pending()
+            rows = self.connection.execute(sql, parameters).fetchall()
+        return [dict(row) for row in rows]
+
+    # Recreate the output/json/src/<directory>/response_<file>.json layout from the latest successful result per file
+    def export_json(self, output_directory=os.path.join('output', 'json'), run_id=None, selected_model=None):
+        conditions = ['succeeded = 1']
+        parameters = []
+        if run_id is not None:
+            conditions.append('run_id = ?')
+            parameters.append(run_id)
+        if selected_model is not None:
+            conditions.append('model = ?')
+            parameters.append(selected_model)
+
+        sql = f'''
+            SELECT source_path, response FROM results
+            WHERE id IN (SELECT MAX(id) FROM results WHERE {' AND '.join(conditions)} GROUP BY source_path)
+        '''
+        with self.lock:
+            self.flush_pending()
+            rows = self.connection.execute(sql, parameters).fetchall()
+
+        for row in rows:
+            file_name_without_extension = os.path.splitext(os.path.basename(row['source_path']))[0]
+            last_directory_name = os.path.basename(os.path.dirname(row['source_path']))
+
+            json_directory = os.path.join(output_directory, 'src', last_directory_name)
+            os.makedirs(json_directory, exist_ok=True)
+
+            json_file_path = os.path.join(json_directory, f'response_{file_name_without_extension}.json')
+            with open(json_file_path, 'w', encoding='utf-8') as json_file:
+                json.dump(json.loads(row['response']), json_file, indent=4)
+
+        return len(rows)
+
+    def close(self):
+        with self.lock:
+            self.flush_pending()
+            self.connection.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Query or export the migration results database.')
+    parser.add_argument('--database', default=os.getenv('RESULTS_PATH', 'output/migration_results.db'))
+    parser.add_argument('--run', help='only include results from this run id')
+    parser.add_argument('--model', help='only include results from this model')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('summary', help='print per-model totals')
+    failures_parser = subparsers.add_parser('failures', help='print the files that failed to migrate')
+    failures_parser.add_argument('--limit', type=int, default=50)
+    export_parser = subparsers.add_parser('export', help='write the per-file response JSON files')
+    export_parser.add_argument('--output', default=os.path.join('output', 'json'))
+    args = parser.parse_args()
+
+    store = ResultsStore(args.database)
+    try:
+        if args.command == 'summary':
+            for row in store.summary(run_id=args.run):
+                if args.model is None or row['model'] == args.model:
+                    print(json.dumps(row))
+        elif args.command == 'failures':
+            for row in store.query(run_id=args.run, selected_model=args.model, succeeded=False, limit=args.limit):
+                print(json.dumps(row))
+        else:
+            exported = store.export_json(args.output, run_id=args.run, selected_model=args.model)
+            print(f'Exported {exported} response files to {args.output}')
+    finally:
+        store.close()
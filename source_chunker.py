@@ -0,0 +1,236 @@
+import re
+
+# Keywords that start a new top-level declaration in Java or JavaScript
+declaration_start = re.compile(
+    r'(?:@|/\*\*|//|package\b|import\b|export\b|module\.exports\b|exports\.|'
+    r'(?:public|protected|private|abstract|final|static|sealed|async)\b|'
+    r'class\b|interface\b|enum\b|record\b|function\b|const\b|let\b|var\b)'
+)
+
+# Text after a closing brace that continues the same statement, e.g. the '= require(...)' of a destructuring
+# declaration or the '=>' of an arrow function
+statement_continuation = re.compile(r'\s*(?:[;,).?:=]|else\b|catch\b|finally\b|while\b)')
+
+# Header statements shared by every chunk of a file
+header_statement = re.compile(
+    r'^\s*(?:package\s|import\s|(?:const|let|var)\s+[\w{}\s,]+=\s*require\()'
+)
+
+# Class-like declarations whose body can be split into members
+class_declaration = re.compile(r'\b(?:class|interface|enum|object)\s+\w+')
+
+# Function to scan Java/JavaScript source and return the positions where top-level or member statements end.
+# Strings, template literals, character literals and comments are skipped so braces inside them are ignored.
+def statement_boundaries(code, depth_level=0):
+    boundaries = []
+    depth = 0
+    paren_depth = 0
+    template_depths = []
+    last_significant = ''
+    i = 0
+    length = len(code)
+
+    while i < length:
+        char = code[i]
+        next_char = code[i + 1] if i + 1 < length else ''
+
+        if char == '/' and next_char == '/':
+            newline = code.find('\n', i)
+            i = length if newline == -1 else newline
+            continue
+
+        if char == '/' and next_char == '*':
+            end = code.find('*/', i + 2)
+            i = length if end == -1 else end + 2
+            continue
+
+        if char in ('"', "'", '`'):
+            quote = char
+            i += 1
+            while i < length and code[i] != quote:
+                if code[i] == '\\':
+                    i += 1
+                elif quote == '`' and code[i] == '$' and i + 1 < length and code[i + 1] == '{':
+                    # Continue scanning code inside the template expression
+                    template_depths.append(depth)
+                    depth += 1
+                    i += 1
+                    break
+                elif quote != '`' and code[i] == '\n':
+                    break
+                i += 1
+            else:
+                i += 1
+                last_significant = quote
+                continue
+            i += 1
+            continue
+
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if template_depths and depth == template_depths[-1]:
+                # Back inside the template literal, skip to its end
+                template_depths.pop()
+                i += 1
+                while i < length and code[i] != '`':
+                    if code[i] == '\\':
+                        i += 1
+                    i += 1
+                i += 1
+                last_significant = '`'
+                continue
+            if depth == depth_level and paren_depth == 0 and not statement_continuation.match(code, i + 1):
+                boundaries.append(i + 1)
+        elif char in '([':
+            paren_depth += 1
+        elif char in ')]':
+            paren_depth = max(0, paren_depth - 1)
+        elif char == ';' and depth == depth_level and paren_depth == 0:
+            boundaries.append(i + 1)
+        elif char == '\n' and depth == depth_level and paren_depth == 0:
+            # JavaScript without semicolons: a new declaration at the start of a line ends the statement
+            previous_line = code[code.rfind('\n', 0, i) + 1:i].strip()
+            if (last_significant and last_significant not in '=,(+-*/&|?:.{};'
+                    and not previous_line.startswith('@')
+                    and declaration_start.match(code, i + 1)):
+                boundaries.append(i + 1)
+
+        if not char.isspace():
+            last_significant = char
+        i += 1
+
+    return boundaries
+
+# Function to split code into segments ending at the given boundaries
+def split_at(code, boundaries, start=0, end=None):
+    end = len(code) if end is None else end
+    segments = []
+    position = start
+    for boundary in boundaries:
+        if start < boundary <= end and code[position:boundary].strip():
+            segments.append(code[position:boundary])
+            position = boundary
+    if code[position:end].strip():
+        segments.append(code[position:end])
+    elif segments:
+        segments[-1] += code[position:end]
+    return segments
+
+# Function to pack consecutive segments into pieces of at most max_chars characters
+def pack_segments(segments, max_chars):
+    pieces = []
+    current = ''
+    for segment in segments:
+        if current and len(current) + len(segment) > max_chars:
+            pieces.append(current)
+            current = ''
+        current += segment
+    if current.strip():
+        pieces.append(current)
+    return pieces
+
+# Function to split a large class into chunks of members, each wrapped in the class declaration
+def split_class(segment, max_chars):
+    declaration_match = class_declaration.search(segment)
+    if declaration_match is None:
+        return None
+
+    body_start = segment.find('{', declaration_match.end())
+    body_end = segment.rfind('}')
+    if body_start == -1 or body_end <= body_start:
+        return None
+
+    shell = segment[:body_start].strip()
+    body = segment[body_start + 1:body_end]
+    members = split_at(body, statement_boundaries(body))
+    if len(members) < 2:
+        return None
+
+    return [
+        {'code': f'{shell} {{{piece.rstrip()}\n}}\n', 'kind': 'member', 'shell': shell}
+        for piece in pack_segments(members, max_chars)
+    ]
+
+# Function to split source code into a shared header and chunks at top-level class/method/function boundaries
+def chunk_source(code, max_chars):
+    segments = split_at(code, statement_boundaries(code))
+
+    # Leading package/import/require statements are sent with every chunk
+    header = ''
+    while segments and header_statement.match(segments[0]):
+        header += segments.pop(0)
+
+    chunks = []
+    pending = []
+    for segment in segments:
+        member_chunks = split_class(segment, max_chars) if len(segment) > max_chars else None
+        if member_chunks is None:
+            pending.append(segment)
+            continue
+
+        for piece in pack_segments(pending, max_chars):
+            chunks.append({'code': piece, 'kind': 'top', 'shell': None})
+        pending = []
+        chunks.extend(member_chunks)
+
+    for piece in pack_segments(pending, max_chars):
+        chunks.append({'code': piece, 'kind': 'top', 'shell': None})
+
+    return header.strip(), chunks
+
+# Function to find the body of the class in a migrated chunk, returning (declaration, body)
+def migrated_class_parts(migrated_code):
+    declaration_match = class_declaration.search(migrated_code)
+    if declaration_match is None:
+        return None, migrated_code
+
+    body_start = migrated_code.find('{', declaration_match.end())
+    body_end = migrated_code.rfind('}')
+    if body_start == -1 or body_end <= body_start:
+        return None, migrated_code
+
+    return migrated_code[:body_start].rstrip(), migrated_code[body_start + 1:body_end].strip('\n')
+
+# Function to put migrated chunks back together in their original order, merging split classes
+def reassemble_chunks(chunks, migrated_pieces):
+    header_lines = []
+    parts = []
+    current_shell = None
+
+    for chunk, migrated_code in zip(chunks, migrated_pieces):
+        # Move header lines to the top, dropping the copies repeated in each chunk
+        code_lines = []
+        for line in migrated_code.splitlines():
+            if header_statement.match(line) and not line.startswith((' ', '\t')):
+                if line.strip() not in header_lines:
+                    header_lines.append(line.strip())
+            else:
+                code_lines.append(line)
+        migrated_code = '\n'.join(code_lines).strip()
+
+        if chunk['kind'] == 'member':
+            declaration, body = migrated_class_parts(migrated_code)
+            if current_shell is not None and current_shell == chunk['shell']:
+                # Another part of the class already started: append only this chunk's members
+                parts[-1]['body'].append(body)
+                continue
+            current_shell = chunk['shell']
+            parts.append({'declaration': declaration, 'body': [body]})
+        else:
+            current_shell = None
+            parts.append({'declaration': None, 'body': [migrated_code]})
+
+    sections = []
+    for part in parts:
+        if part['declaration'] is None:
+            sections.append('\n\n'.join(part['body']))
+        else:
+            body = '\n\n'.join(part['body'])
+            sections.append(f"{part['declaration']} {{\n{body}\n}}")
+
+    assembled = '\n\n'.join(section for section in sections if section)
+    if header_lines:
+        assembled = '\n'.join(header_lines) + '\n\n' + assembled
+    return assembled
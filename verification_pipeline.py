@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import queue
+import threading
+import subprocess
+from datetime import datetime
+
+# Background stage that checks each migrated file as soon as it is written, while other files are still being migrated.
+# Commands may use {worker} for per-worker paths, so parallel checks do not share compiler state files.
+class VerificationPipeline:
+    def __init__(self, commands, results_path, workers=2, timeout=300):
+        self.commands = commands
+        self.results_path = results_path
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+        self.results_lock = threading.Lock()
+        self.summary = {'passed': 0, 'failed': 0}
+
+        directory = os.path.dirname(results_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.results_file = open(results_path, 'a', encoding='utf-8')
+
+        self.workers = [threading.Thread(target=self.worker, args=(worker_number,), daemon=True) for worker_number in range(workers)]
+        for worker in self.workers:
+            worker.start()
+
+    # Queue a written output file for checking, unless it is already waiting in the queue
+    def submit(self, file_path):
+        extension = os.path.splitext(file_path)[1].lstrip('.')
+        if extension not in self.commands:
+            return
+
+        with self.pending_lock:
+            if file_path in self.pending:
+                return
+            self.pending.add(file_path)
+        self.queue.put(file_path)
+
+    def worker(self, worker_number):
+        while True:
+            file_path = self.queue.get()
+            if file_path is None:
+                return
+
+            with self.pending_lock:
+                self.pending.discard(file_path)
+            self.record(self.check(file_path, worker_number))
+
+    # Run the fast compile/type check for one file
+    def check(self, file_path, worker_number=0):
+        extension = os.path.splitext(file_path)[1].lstrip('.')
+        command = self.commands[extension]
+        start_time = time.time()
+
+        try:
+            command = command.format(file=file_path, worker=worker_number)
+            result = subprocess.run(command, shell=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    encoding='utf-8', timeout=self.timeout)
+            passed = result.returncode == 0
+            return_code = result.returncode
+            output = (result.stdout + result.stderr).strip()
+        except subprocess.TimeoutExpired:
+            passed = False
+            return_code = None
+            output = f'Check timed out after {self.timeout} seconds'
+        except Exception as e:
+            # Record a check that could not run (e.g. a bad command template) as failed, keeping the worker alive
+            passed = False
+            return_code = None
+            output = f'Check could not run: {e}'
+
+        return {
+            'file': file_path,
+            'command': command,
+            'passed': passed,
+            'return_code': return_code,
+            'duration': time.time() - start_time,
+            # Keep the end of the output, where compilers print the error summary
+            'output': output[-4000:],
+            'checked_at': datetime.now().isoformat()
+        }
+
+    def record(self, result):
+        with self.results_lock:
+            self.summary['passed' if result['passed'] else 'failed'] += 1
+            self.results_file.write(json.dumps(result) + '\n')
+            self.results_file.flush()
+
+    # Wait for the queued checks to finish and return the number of passed and failed files
+    def close(self):
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+        self.results_file.close()
+        return dict(self.summary)